@@ -4,6 +4,7 @@ Read and write configuration
 
 from os.path import isfile
 from decimal import Decimal
+from uuid import uuid4
 from ConfigParser import ConfigParser, DEFAULTSECT
 
 
@@ -28,6 +29,8 @@ class Configuration(object):
         """
         self.__fullpath = fullpath
         self.__force_defaults = force_defaults
+        self.__version = 0
+        self.__database_id = None
 
         if not isfile(self.__fullpath):
             open(self.__fullpath, "w").close()
@@ -45,12 +48,16 @@ class Configuration(object):
 
         config = ConfigParser(defaults)
 
-        if not self.__force_defaults:
-            f = open(self.__fullpath, 'r')
-            try:
-                config.readfp(f)
-            finally:
-                f.close()
+        f = open(self.__fullpath, 'r')
+        try:
+            config.readfp(f)
+        finally:
+            f.close()
+        # Database id isn't a preference, it is kept when defaults are forced
+        if config.has_option(DEFAULTSECT, "database_id"):
+            self.__database_id = config.get(DEFAULTSECT, "database_id")
+        if self.__force_defaults:
+            config = ConfigParser(defaults)
 
         self.set_gear_handicap(
             config.get(DEFAULTSECT, "gear_handicap"))
@@ -88,6 +95,8 @@ class Configuration(object):
             DEFAULTSECT, "underweight_step", str(self.underweight_step))
         config.set(
             DEFAULTSECT, "allowed_difference", str(self.allowed_difference))
+        if self.__database_id is not None:
+            config.set(DEFAULTSECT, "database_id", self.__database_id)
 
         f = open(self.__fullpath, 'wb')
         try:
@@ -95,12 +104,32 @@ class Configuration(object):
         finally:
             f.close()
 
+    @property
+    def version(self):
+        """
+        version -> int - return number of value changes, values derived
+        from configuration are valid while the version is the same
+        """
+        return self.__version
+
+    @property
+    def database_id(self):
+        """
+        database_id -> str - return identifier of the database, it is
+        generated and saved on first use
+        """
+        if self.__database_id is None:
+            self.__database_id = uuid4().hex
+            self.save()
+        return self.__database_id
+
     @property
     def gear_handicap(self):
         return self.__gear_handicap
 
     def set_gear_handicap(self, value):
         self.__gear_handicap = Decimal(value)
+        self.__version += 1
 
     @property
     def winglets_handicap(self):
@@ -108,6 +137,7 @@ class Configuration(object):
 
     def set_winglets_handicap(self, value):
         self.__winglets_handicap = Decimal(value)
+        self.__version += 1
 
     @property
     def overweight_handicap(self):
@@ -115,6 +145,7 @@ class Configuration(object):
 
     def set_overweight_handicap(self, value):
         self.__overweight_handicap = Decimal(value)
+        self.__version += 1
 
     @property
     def overweight_step(self):
@@ -122,6 +153,7 @@ class Configuration(object):
 
     def set_overweight_step(self, value):
         self.__overweight_step = int(value)
+        self.__version += 1
 
     @property
     def underweight_handicap(self):
@@ -129,6 +161,7 @@ class Configuration(object):
 
     def set_underweight_handicap(self, value):
         self.__underweight_handicap = Decimal(value)
+        self.__version += 1
 
     @property
     def underweight_step(self):
@@ -136,6 +169,7 @@ class Configuration(object):
 
     def set_underweight_step(self, value):
         self.__underweight_step = int(value)
+        self.__version += 1
 
     @property
     def allowed_difference(self):
@@ -143,3 +177,4 @@ class Configuration(object):
 
     def set_allowed_difference(self, value):
         self.__allowed_difference = int(value)
+        self.__version += 1
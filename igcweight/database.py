@@ -2,10 +2,13 @@
 Database connection and sessions
 """
 
+import locale
+
 from sqlalchemy.engine.url import URL
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.interfaces import PoolListener
+from sqlalchemy.orm.interfaces import SessionExtension
+from sqlalchemy.interfaces import PoolListener, ConnectionProxy
 
 from igcweight import settings
 
@@ -23,17 +26,78 @@ if settings.DB_DATABASE != '':
     __engine_url['database'] = settings.DB_DATABASE
 
 
+def locale_collate(a, b):
+    """
+    locale_collate(str a, str b) -> int - compare strings according to
+    current locale, used as database collation
+    """
+    if isinstance(a, str):
+        a = a.decode('utf-8')
+    if isinstance(b, str):
+        b = b.decode('utf-8')
+    return locale.strcoll(a, b)
+
+
 class ForeignKeysListener(PoolListener):
 
     def connect(self, dbapi_con, con_record):
         dbapi_con.execute('pragma foreign_keys=ON')
 
+
+class LocaleCollationListener(PoolListener):
+
+    def connect(self, dbapi_con, con_record):
+        dbapi_con.create_collation('locale', locale_collate)
+
+
+class QueryCounter(ConnectionProxy):
+    """
+    Count executed SQL statements, used in debug mode only
+    """
+
+    count = 0
+
+    def cursor_execute(self, execute, cursor, statement, parameters,
+                       context, executemany):
+        QueryCounter.count += 1
+        return execute(cursor, statement, parameters, context)
+
+
+def query_count():
+    """
+    query_count() -> int - return number of SQL statements executed so far,
+    they are counted in debug mode only
+    """
+    return QueryCounter.count
+
+
 engine = create_engine(
     URL(**__engine_url),
     echo=settings.DEBUG,
     convert_unicode=True,
-    listeners=[ForeignKeysListener()]
+    listeners=[ForeignKeysListener(), LocaleCollationListener()],
+    proxy=QueryCounter() if settings.DEBUG else None
 )
 
-Session = sessionmaker(bind=engine, autoflush=True)
+
+class CommitCounter(SessionExtension):
+    """
+    Count committed session transactions
+    """
+
+    count = 0
+
+    def after_commit(self, session):
+        CommitCounter.count += 1
+
+
+def commit_count():
+    """
+    commit_count() -> int - return number of session commits so far, it
+    changes whenever any record may have changed
+    """
+    return CommitCounter.count
+
+Session = sessionmaker(
+    bind=engine, autoflush=True, extension=CommitCounter())
 session = Session()
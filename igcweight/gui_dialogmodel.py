@@ -2,15 +2,16 @@
 GUI - DialogModel ancestor
 """
 
-import locale
-
 import wx
 from wx import GetTranslation as _
 
+from sqlalchemy.orm import Query
+
 from igcweight import gui_forms
 
 from igcweight.database import session
-from igcweight.gui_widgets import error_message_dialog
+from igcweight.search import order_clauses
+from igcweight.gui_widgets import error_message_dialog, PagedDatasource
 
 
 class DialogModel(gui_forms.DialogModel):
@@ -25,6 +26,7 @@ class DialogModel(gui_forms.DialogModel):
         gui_forms.DialogModel.__init__(self, *args, **kwargs)
 
         self.__edit_dialog = None
+        self.__query = None
         self.message_insert_error = _("Insert error")
         self.message_edit_error = _("Edit error")
         self.message_delete_error = _("Delete error")
@@ -72,13 +74,23 @@ class DialogModel(gui_forms.DialogModel):
 
     def set_datasource(self, value):
         """
-        datasource(self, list value) - set datasource, value is a
-        SQLAlchemy query
+        datasource(self, value) - set datasource, value is a SQLAlchemy
+        query (sorted by database) or list of db items
         """
+        clauses = None
+        if isinstance(value, Query):
+            self.__query = value
+            clauses = self.__order_clauses(0)
+            if clauses is not None:
+                value = value.order_by(None).order_by(*clauses)
+            value = PagedDatasource(value, self.__model())
+        else:
+            self.__query = None
         self.list_ctrl.datasource = value
         count = len(self.datasource)
         if count > 0:
-            self.Sort(0)
+            if clauses is None:
+                self.list_ctrl.SortDatasource(0)
             self.list_ctrl.SetItemCount(count)
             self.list_ctrl.Select(0)
             self.list_ctrl.Focus(0)
@@ -149,22 +161,41 @@ class DialogModel(gui_forms.DialogModel):
         """
         self.Sort(evt.m_col)
 
+    def __order_clauses(self, col):
+        """
+        __order_clauses(self, long col) -> list - return ORDER BY clauses
+        of column, None if datasource must be sorted in Python
+        """
+        if self.__query is None:
+            return None
+        return order_clauses(
+            self.__model(), self.list_ctrl.GetColumnFieldName(col))
+
+    def __model(self):
+        """
+        __model(self) -> class - return model of datasource query
+        """
+        return self.__query.column_descriptions[0]['type']
+
     def Sort(self, col):
         """
-        Sort(self, long col) - sort list ctrl
+        Sort(self, long col) - sort list ctrl, by database if datasource
+        was set as query
         """
         if self.datasource is not None:
             count = len(self.datasource)
             if count > 0:
-                colname = self.list_ctrl.GetColumnFieldName(col)
                 current_item = self.list_ctrl.current_item
                 self.list_ctrl.SetItemCount(0)
-                self.datasource.sort(
-                    lambda a, b: locale.strcoll(
-                        a.column_as_str(colname), b.column_as_str(colname)
-                    )
-                )
-                if current_item is None:
+                clauses = self.__order_clauses(col)
+                if clauses is None:
+                    self.list_ctrl.SortDatasource(col)
+                else:
+                    self.list_ctrl.datasource = PagedDatasource(
+                        self.__query.order_by(None).order_by(*clauses),
+                        self.__model())
+                    count = len(self.datasource)
+                if current_item not in self.datasource:
                     i = 0
                 else:
                     i = self.datasource.index(current_item)
@@ -239,6 +270,7 @@ class DialogModel(gui_forms.DialogModel):
                     if dlg.ShowModal() == wx.ID_OK:
                         record = dlg.GetData()
                         session.commit()
+                        self.list_ctrl.InvalidateSortKeys(record)
                         self.list_ctrl.RefreshItem(
                             self.list_ctrl.GetFocusedItem())
                     break
@@ -271,6 +303,7 @@ class DialogModel(gui_forms.DialogModel):
                 try:
                     session.delete(record)
                     session.commit()
+                    self.list_ctrl.InvalidateSortKeys(record)
                     self.list_ctrl.DeleteAllItems()
                     del(self.datasource[i])
                     i = i - 1
@@ -49,7 +49,7 @@ class IgcHandicapList(gui_dialogmodel.DialogModel):
             format=wx.LIST_FORMAT_RIGHT, proportion=1)
 
         # Open data source
-        self.datasource = session.query( GliderType ).all()
+        self.datasource = session.query(GliderType)
         # Assign edit dialog
         self.edit_dialog = IgcHandicapForm
         # Assign error messages
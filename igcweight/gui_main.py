@@ -4,14 +4,12 @@ GUI - Main window
 
 import os
 import locale
+import threading
 
 from os import remove, system
 from os.path import splitext, abspath, dirname
 from os.path import join as joinpath
-from shutil import copy
-from hashlib import md5
 from datetime import datetime
-from math import fabs
 
 import wx
 from wx.lib.multisash import EmptyChild
@@ -28,18 +26,29 @@ except ImportError:
 
 from igcweight import settings
 
-from igcweight.database import session
+from igcweight.database import session, Session, query_count
 from igcweight.models import (
     GliderCard, Pilot, Organization, GliderType, Photo, DailyWeight)
 from igcweight.gui_widgets import (
-    error_message_dialog, info_message_dialog, VirtualListCtrl, GetPhotoBitmap)
+    error_message_dialog, info_message_dialog, VirtualListCtrl,
+    GetPhotoBitmap, PrepareThumbnail, PagedDatasource, thumbnails_cache,
+    thumbnail_level, ResetThumbnails, TowBarStatus)
 from igcweight.gui_igchandicap import (
     IgcHandicapList, IgcHandicapForm, GLIDER_TYPE_INSERT_ERROR)
 from igcweight.gui_organizations import (
     OrganizationList, OrganizationForm, ORGANIZATION_INSERT_ERROR)
 from igcweight.gui_pilots import PilotList, PilotForm, PILOT_INSERT_ERROR
 from igcweight.gui_preferences import Preferences
-from igcweight.importexport import patternt_tar, Export, Import, CleanDb
+from igcweight.gui_reports import DailyReport
+from igcweight.search import (
+    FIELDS as SEARCH_FIELDS, glider_card_query, glider_card_filter,
+    non_compliant_filter, order_clauses)
+from igcweight.handicap import update_status
+from igcweight.reports import tow_bar_status
+from igcweight.photostore import add_photo_file
+from igcweight.importexport import (
+    patternt_tar, Export, ImportChain, CleanDb, LastJournalId,
+    ChangedPhotos)
 
 _fake_variable_1 = _('Glider card - club class')
 
@@ -66,17 +75,13 @@ class Main(wx.Frame):
     COEFFICIENT = _(
         "Competition coefficient is %(coefficient)s at weight %(weight)d kg.")
     COEFFICIENT_NO_DATA = _("No data for count coefficient.")
-    TOW_BAR_OK = _("* In the limit")
-    TOW_BAR_OVERWEIGHT = _("! Overweight by %d kg")
-    TOW_BAR_UNDERWEIGHT = _("! Underweight by %d kg")
-    TOW_BAR_UNDERWEIGHT_NO_CLUB = _("* Underweight by %d kg, OK")
-    TOW_BAR_NO_DATA = _("? No data")
     NOT_USED = _("No club class, not used")
     COLOR_TEXT = wx.SystemSettings_GetColour(wx.SYS_COLOUR_WINDOWTEXT)
     COLOR_OK = 'DARK GREEN'
     COLOR_OVERWEIGHT = 'RED'
     COLOR_UNDERWEIGHT = 'ORANGE'
     COLOR_NO_DATA = 'BLUE'
+    SEARCH_DELAY = 300
 
     def __init__(self, *args, **kwds):
         """
@@ -108,6 +113,10 @@ class Main(wx.Frame):
             self.menu_file, wx.NewId(), _("&Export..."),
             _("Export data into archive file"), wx.ITEM_NORMAL)
         self.menu_file.AppendItem(self.menu_export)
+        self.menu_export_changes = wx.MenuItem(
+            self.menu_file, wx.NewId(), _("Export c&hanges..."),
+            _("Export data changed since baseline archive"), wx.ITEM_NORMAL)
+        self.menu_file.AppendItem(self.menu_export_changes)
         self.menu_clean = wx.MenuItem(
             self.menu_file, wx.NewId(), _("&Clean database..."),
             _("Clean old data from database"), wx.ITEM_NORMAL)
@@ -183,6 +192,11 @@ class Main(wx.Frame):
             self.menu_daily_weight, wx.NewId(), _("&Delete"),
             _("Delete daily weight"), wx.ITEM_NORMAL)
         self.menu_daily_weight.AppendItem(self.menu_daily_weight_delete)
+        self.menu_daily_weight.AppendSeparator()
+        self.menu_daily_report = wx.MenuItem(
+            self.menu_daily_weight, wx.NewId(), _("&Report...\tCtrl+R"),
+            _("Tow bar status of all gliders for a day"), wx.ITEM_NORMAL)
+        self.menu_daily_weight.AppendItem(self.menu_daily_report)
         self.main_menu.Append(self.menu_daily_weight, _("&Daily weight"))
         self.menu_help = wx.Menu()
         self.menu_about = wx.MenuItem(
@@ -206,6 +220,8 @@ class Main(wx.Frame):
             self.panel_gliders, -1, style=wx.TE_PROCESS_ENTER)
         self.combo_find = wx.ComboBox(
             self.panel_gliders, -1, choices=find_choices, style=wx.CB_READONLY)
+        self.cb_non_compliant = wx.CheckBox(
+            self.panel_gliders, -1, _("Non-compliant"))
         self.list_glider_card = VirtualListCtrl(self.panel_gliders, -1)
         self.button_glider_card_new = wx.Button(
             self.panel_gliders, wx.ID_NEW, "")
@@ -289,6 +305,7 @@ class Main(wx.Frame):
             self.__list_daily_weigh_get_item_text)
         self.list_daily_weight.GetItemAttrMethod = (
             self.__list_daily_weigh_get_item_attr)
+        self.__tow_bar_status = TowBarStatus()
         self.button_daily_weight_new = wx.Button(
             self.panel_card, wx.ID_NEW, "")
         self.button_daily_weight_properties = wx.Button(
@@ -303,7 +320,10 @@ class Main(wx.Frame):
         self.__do_layout()
 
         self.__sort_glider_card = 0
+        self.__query_glider_card = None
         self.__filtered = False
+        self.__search_timer = None
+        self.__search_generation = 0
 
         # Set grid columns
         self.list_glider_card.InsertColumn(
@@ -323,13 +343,8 @@ class Main(wx.Frame):
             2, _("Status"), 'status', proportion=4)
 
         # Open data sources
-        self.BASE_QUERY = session.query(
-            GliderCard
-        ).join(
-            (Pilot, GliderCard.pilot_id == Pilot.id),
-            (GliderType, GliderCard.glider_type_id == GliderType.id)
-        )
-        self.datasource_glider_card = self.BASE_QUERY.all()
+        self.BASE_QUERY = glider_card_query(session)
+        self.LoadGliderCards()
 
         # Bind events
         self.Bind(
@@ -341,6 +356,8 @@ class Main(wx.Frame):
         self.Bind(wx.EVT_CLOSE, self.Exit, self)
         self.Bind(wx.EVT_MENU, self.Import, self.menu_import)
         self.Bind(wx.EVT_MENU, self.Export, self.menu_export)
+        self.Bind(
+            wx.EVT_MENU, self.ExportChanges, self.menu_export_changes)
         self.Bind(wx.EVT_MENU, self.CleanDb, self.menu_clean)
         self.Bind(wx.EVT_MENU, self.Exit, self.menu_exit)
         self.Bind(wx.EVT_MENU, self.About, self.menu_about)
@@ -368,15 +385,19 @@ class Main(wx.Frame):
             self.menu_daily_weight_properties)
         self.Bind(
             wx.EVT_MENU, self.DailyWeightDelete, self.menu_daily_weight_delete)
+        self.Bind(wx.EVT_MENU, self.DailyReport, self.menu_daily_report)
         self.Bind(wx.EVT_BUTTON, self.PrevPhoto, self.button_photo_prev)
         self.Bind(wx.EVT_BUTTON, self.ShowPhoto, self.button_photo_show)
         self.Bind(wx.EVT_BUTTON, self.NextPhoto, self.button_photo_next)
         self.Bind(wx.EVT_TEXT_ENTER, self.SearchGliderCard, self.text_find)
+        self.Bind(wx.EVT_TEXT, self.__find_text_changed, self.text_find)
         self.Bind(
             wx.EVT_SEARCHCTRL_SEARCH_BTN,
             self.SearchGliderCard, self.text_find)
         self.Bind(
             wx.EVT_SEARCHCTRL_CANCEL_BTN, self.AllGliderCard, self.text_find)
+        self.Bind(
+            wx.EVT_CHECKBOX, self.SearchGliderCard, self.cb_non_compliant)
         self.list_glider_card.Bind(
             wx.EVT_CONTEXT_MENU, self.__list_glider_card_popup_menu)
         self.list_glider_card.Bind(
@@ -410,6 +431,8 @@ class Main(wx.Frame):
         self.text_find.ShowSearchButton(True)
         self.text_find.ShowCancelButton(True)
         self.combo_find.SetSelection(0)
+        self.cb_non_compliant.SetToolTipString(
+            _("Show only gliders with overweight status"))
 
         self.button_glider_card_new.SetToolTipString(_("Add new glider"))
         self.button_glider_card_new.Enable(False)
@@ -485,6 +508,8 @@ class Main(wx.Frame):
         sizer_find = wx.BoxSizer(wx.HORIZONTAL)
         sizer_find.Add(self.text_find, 3, wx.RIGHT | wx.EXPAND, 2)
         sizer_find.Add(self.combo_find, 2, wx.LEFT | wx.EXPAND, 2)
+        sizer_find.Add(
+            self.cb_non_compliant, 0, wx.LEFT | wx.ALIGN_CENTER_VERTICAL, 4)
         # Glider (left panel) sizer
         sizer_gliders = wx.BoxSizer(wx.VERTICAL)
         sizer_gliders.Add(
@@ -676,7 +701,7 @@ class Main(wx.Frame):
 
     def get_datasource_glider_card(self):
         """
-        datasource_glider_card(self) -> list of db items (SQLAlchemy query)
+        datasource_glider_card(self) -> PagedDatasource of glider cards
         """
         return getattr(self.list_glider_card, 'datasource', None)
 
@@ -690,7 +715,9 @@ class Main(wx.Frame):
             count = len(self.datasource_glider_card)
             self.list_glider_card.SetItemCount(count)
             if count > 0:
-                self.SortGliderCardList(self.__sort_glider_card)
+                if self.__glider_card_order() is None:
+                    self.list_glider_card.SortDatasource(
+                        self.__sort_glider_card)
                 self.list_glider_card.Select(0)
                 self.list_glider_card.Focus(0)
         else:
@@ -700,6 +727,28 @@ class Main(wx.Frame):
     datasource_glider_card = property(
         get_datasource_glider_card, set_datasource_glider_card)
 
+    def __glider_card_order(self):
+        """
+        __glider_card_order(self) -> list - return ORDER BY clauses of
+        current sort column, None if glider cards are sorted in Python
+        """
+        return order_clauses(
+            GliderCard, self.list_glider_card.GetColumnFieldName(
+                self.__sort_glider_card))
+
+    def LoadGliderCards(self, query=None):
+        """
+        LoadGliderCards(self, Query query=None) - load glider cards sorted
+        by current column, query defaults to all glider cards
+        """
+        if query is None:
+            query = self.BASE_QUERY
+        self.__query_glider_card = query
+        clauses = self.__glider_card_order()
+        if clauses is not None:
+            query = query.order_by(*clauses)
+        self.datasource_glider_card = PagedDatasource(query, GliderCard)
+
     def __set_enabled_disabled(self):
         """
         __set_enabled_disabled(self) - enable or disable controls
@@ -806,18 +855,9 @@ class Main(wx.Frame):
 
         if colname == 'status':
             difference = daily_weight.tow_bar_difference
-            if difference is None:
-                return self.TOW_BAR_NO_DATA
-            difference_abs = fabs(difference)
-            if difference_abs <= settings.configuration.allowed_difference:
-                return self.TOW_BAR_OK
-            elif difference > 0:
-                return self.TOW_BAR_OVERWEIGHT % difference_abs
-            elif difference < 0:
-                t = (
-                    self.TOW_BAR_UNDERWEIGHT if record.glider_type.club_class
-                    else self.TOW_BAR_UNDERWEIGHT_NO_CLUB)
-                return t % difference_abs
+            return self.__tow_bar_status.text(
+                tow_bar_status(difference), difference,
+                record.glider_type.club_class)
         else:
             return daily_weight.column_as_str(colname)
 
@@ -828,20 +868,9 @@ class Main(wx.Frame):
         """
         record = self.list_glider_card.current_item
         daily_weight = record.daily_weight[item]
-        difference = daily_weight.tow_bar_difference
-
-        if difference is None:
-            return wx.ListItemAttr(colText=self.COLOR_NO_DATA)
-        difference_abs = fabs(difference)
-        if difference_abs <= settings.configuration.allowed_difference:
-            return wx.ListItemAttr(colText=self.COLOR_OK)
-        elif difference > 0:
-            return wx.ListItemAttr(colText=self.COLOR_OVERWEIGHT)
-        elif difference < 0:
-            c = (
-                self.COLOR_OVERWEIGHT if record.glider_type.club_class
-                else self.COLOR_OK)
-            return wx.ListItemAttr(colText=c)
+        return self.__tow_bar_status.attr(
+            tow_bar_status(daily_weight.tow_bar_difference),
+            record.glider_type.club_class)
 
     def SortGliderCardList(self, col):
         """
@@ -849,23 +878,32 @@ class Main(wx.Frame):
         tile event handler
         """
         if self.datasource_glider_card is not None:
+            queries = query_count()
             count = len(self.datasource_glider_card)
             if count > 0:
-                colname = self.list_glider_card.GetColumnFieldName(col)
                 current_item = self.list_glider_card.current_item
                 self.list_glider_card.SetItemCount(0)
-                self.datasource_glider_card.sort(
-                    lambda a, b: locale.strcoll(
-                        a.column_as_str(colname), b.column_as_str(colname)
-                    )
-                )
-                if current_item is None:
+                clauses = order_clauses(
+                    GliderCard, self.list_glider_card.GetColumnFieldName(col))
+                if clauses is None or self.__query_glider_card is None:
+                    self.list_glider_card.SortDatasource(col)
+                else:
+                    self.list_glider_card.datasource = PagedDatasource(
+                        self.__query_glider_card.order_by(*clauses),
+                        GliderCard)
+                    count = len(self.datasource_glider_card)
+                if current_item not in self.datasource_glider_card:
                     i = 0
                 else:
                     i = self.datasource_glider_card.index(current_item)
                 self.list_glider_card.SetItemCount(count)
                 self.list_glider_card.Select(i)
                 self.list_glider_card.Focus(i)
+            if settings.DEBUG:
+                # Check of settings.GLIDER_CARD_LOADING strategy
+                self.statusbar.SetStatusText(
+                    "Sort %d glider cards: %d SQL statements" % (
+                        count, query_count() - queries))
 
     def Import(self, evt):
         """
@@ -875,17 +913,29 @@ class Main(wx.Frame):
             dlg = wx.FileDialog(
                 self, defaultDir=settings.USER_DIR, message=_("Import data"),
                 wildcard=_("TAR files")+" (*.tar)|*.tar;*.TAR",
-                style=wx.FD_OPEN | wx.FD_FILE_MUST_EXIST)
+                style=wx.FD_OPEN | wx.FD_FILE_MUST_EXIST | wx.FD_MULTIPLE)
             try:
                 if dlg.ShowModal() == wx.ID_OK:
                     self.datasource_glider_card = None
                     try:
-                        fullpath = abspath(dlg.GetPath())
-                        Import(fullpath)
+                        fullpaths = [abspath(p) for p in dlg.GetPaths()]
+                        since = LastJournalId()
+                        rows, seconds = ImportChain(fullpaths)
+                        ResetThumbnails()
+                        # Generate thumbnails of imported photos in advance,
+                        # only the size shown in the main window
+                        level = thumbnail_level(self.photo.ClientSize)
+                        for photo in ChangedPhotos(since):
+                            PrepareThumbnail(photo, level)
                         info_message_dialog(
-                            self, _("Data were succesfully imported"))
+                            self, "%s\n\n%s" % (
+                                _("Data were succesfully imported"),
+                                _("%(rows)d records imported, %(speed)d "
+                                  "records per second") % {
+                                    'rows': rows,
+                                    'speed': rows / max(seconds, 0.001)}))
                     finally:
-                        self.datasource_glider_card = self.BASE_QUERY.all()
+                        self.LoadGliderCards()
             finally:
                 dlg.Destroy()
         except Exception, e:
@@ -897,17 +947,48 @@ class Main(wx.Frame):
         """
         Export(self, Event evt) - export data into archive file
         """
+        self.__export()
+
+    def ExportChanges(self, evt):
+        """
+        ExportChanges(self, Event evt) - export data changed since baseline
+        archive into archive file
+        """
+        dlg = wx.FileDialog(
+            self, defaultDir=settings.USER_DIR,
+            message=_("Choose baseline archive"),
+            wildcard=_("TAR files")+" (*.tar)|*.tar;*.TAR",
+            style=wx.FD_OPEN | wx.FD_FILE_MUST_EXIST)
+        try:
+            if dlg.ShowModal() != wx.ID_OK:
+                return
+            baseline = abspath(dlg.GetPath())
+        finally:
+            dlg.Destroy()
+        self.__export(baseline)
+
+    def __export(self, baseline=None):
+        """
+        __export(self, str baseline=None) - export data into archive file,
+        only changes since baseline archive if it is set
+        """
         try:
             dlg = wx.FileDialog(
                 self, defaultDir=settings.USER_DIR, message=_("Export data"),
-                wildcard=_("TAR files")+" (*.tar)|*.tar;*.TAR",
+                wildcard="|".join((
+                    _("TAR files")+" (*.tar)|*.tar;*.TAR",
+                    _("TAR files, gzip compressed data") +
+                    " (*.tar)|*.tar;*.TAR",
+                    _("TAR files, bzip2 compressed data") +
+                    " (*.tar)|*.tar;*.TAR")),
                 style=wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT)
             try:
                 if dlg.ShowModal() == wx.ID_OK:
                     fullpath = abspath(dlg.GetPath())
                     if not patternt_tar.search(fullpath):
                         fullpath = "%s.tar" % fullpath
-                    Export(fullpath)
+                    compression = (None, 'gz', 'bz2')[dlg.GetFilterIndex()]
+                    Export(fullpath, compression, baseline)
                     info_message_dialog(
                         self, _("Data were succesfully exported"))
             finally:
@@ -957,9 +1038,10 @@ class Main(wx.Frame):
                     measured_weights = False
 
                 CleanDb(models, dlg.cb_preferences.Value, measured_weights)
+                ResetThumbnails()
 
                 self.list_glider_card.SetItemCount(0)
-                self.datasource_glider_card = self.BASE_QUERY.all()
+                self.LoadGliderCards()
                 self.RefreshGliderCard()
         finally:
             dlg.Destroy()
@@ -1019,6 +1101,7 @@ SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.""")
         dlg = IgcHandicapList(self)
         try:
             dlg.ShowModal()
+            self.list_glider_card.InvalidateSortKeys()
             self.RefreshGliderCard()
         finally:
             dlg.Destroy()
@@ -1031,6 +1114,7 @@ SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.""")
         dlg = PilotList(self)
         try:
             dlg.ShowModal()
+            self.list_glider_card.InvalidateSortKeys()
             self.RefreshGliderCard()
         finally:
             dlg.Destroy()
@@ -1043,6 +1127,7 @@ SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.""")
         dlg = OrganizationList(self)
         try:
             dlg.ShowModal()
+            self.list_glider_card.InvalidateSortKeys()
             self.RefreshGliderCard()
         finally:
             dlg.Destroy()
@@ -1082,9 +1167,15 @@ SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.""")
                         settings.configuration.set_allowed_difference(
                             dlg.allowed_difference)
                         settings.configuration.save()
+                        # Coefficients depend on handicaps
+                        update_status(session.connection())
+                        session.commit()
+                        if self.__filtered:
+                            self.__search()
                         self.RefreshGliderCard()
                     break
                 except Exception, e:
+                    session.rollback()
                     error_message_dialog(self, _("Preferences save error"), e)
         finally:
             dlg.Destroy()
@@ -1149,6 +1240,7 @@ SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.""")
                         session.commit()
                         # TODO:
                         # self.__delete_photos(dlg.deleted_photos)
+                        self.list_glider_card.InvalidateSortKeys(record)
                         self.list_glider_card.RefreshItem(
                             self.list_glider_card.GetFocusedItem())
                         self.RefreshGliderCard()
@@ -1176,10 +1268,14 @@ SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.""")
                 i = self.datasource_glider_card.index(record)
                 try:
                     photos_path = [photo.full_path for photo in record.photos]
+                    photos_md5 = [photo.md5 for photo in record.photos]
                     session.delete(record)
                     session.commit()
+                    self.list_glider_card.InvalidateSortKeys(record)
                     self.list_glider_card.DeleteAllItems()
                     self.__delete_photos(photos_path)
+                    for photo_md5 in photos_md5:
+                        thumbnails_cache.invalidate(photo_md5)
                     del(self.datasource_glider_card[i])
                     i = i - 1
                     i = i >= 0 and i or 0
@@ -1371,30 +1467,110 @@ SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.""")
                 session.rollback()
                 error_message_dialog(self, _("Daily weight delete error"), e)
 
-    def SearchGliderCard(self, evt=None):
+    def DailyReport(self, evt=None):
         """
-        SearchGliderCard(self, Event evt=None) - filter glider card
-        according to competition number or registration
+        DailyReport(self, Event evt=None) - open daily report window
+        event handler
+        """
+        dlg = DailyReport(self)
+        try:
+            dlg.ShowModal()
+        finally:
+            dlg.Destroy()
+
+    def __find_text_changed(self, evt):
+        """
+        __find_text_changed(self, Event evt) - search text changed, start
+        search when user stops typing
+        """
+        timer = self.__search_timer
+        if timer is not None and timer.IsRunning():
+            timer.Restart(self.SEARCH_DELAY)
+        else:
+            self.__search_timer = wx.CallLater(
+                self.SEARCH_DELAY, self.__search)
+        evt.Skip()
+
+    def __search(self):
         """
+        __search(self) - filter glider cards on the worker thread, empty
+        value shows all glider cards, non-compliant ones only if it is
+        checked
+        """
+        if self.__search_timer is not None:
+            self.__search_timer.Stop()
         value = self.text_find.Value
         field = self.combo_find.GetSelection()
         if value != '' and field != wx.NOT_FOUND:
-            if field == 0:
-                self.datasource_glider_card = self.BASE_QUERY.filter(
-                    GliderCard.competition_number.ilike(value)).all()
-            elif field == 1:
-                self.datasource_glider_card = self.BASE_QUERY.filter(
-                    GliderCard.registration.ilike('%%%s%%' % value)).all()
-            elif field == 2:
-                self.datasource_glider_card = self.BASE_QUERY.filter(
-                    GliderType.name.ilike('%%%s%%' % value)).all()
-            elif field == 3:
-                self.datasource_glider_card = self.BASE_QUERY.filter(
-                    Pilot.surname.ilike('%s%%' % value)).all()
-            self.__filtered = True
-            self.RefreshGliderCard()
+            field = SEARCH_FIELDS[field]
         else:
-            self.AllGliderCard()
+            field = None
+        non_compliant = self.cb_non_compliant.Value
+        self.__search_generation += 1
+        thread = threading.Thread(
+            target=self.__search_worker,
+            args=(self.__search_generation, field, value, non_compliant,
+                  self.__glider_card_order()))
+        thread.setDaemon(True)
+        thread.start()
+
+    def __search_worker(self, generation, field, value, non_compliant,
+                        clauses):
+        """
+        __search_worker(self, int generation, str field, str value,
+        bool non_compliant, list clauses) - run search query sorted by
+        clauses in own session, found glider card ids are passed to GUI
+        thread
+        """
+        ids = None
+        error = None
+        worker_session = Session()
+        try:
+            query = glider_card_query(worker_session)
+            if field is not None:
+                query = query.filter(glider_card_filter(field, value))
+            if non_compliant:
+                query = query.filter(non_compliant_filter())
+            if clauses is not None:
+                query = query.order_by(*clauses)
+            ids = [row[0] for row in query.values(GliderCard.id)]
+        except Exception, e:
+            error = e
+        finally:
+            worker_session.close()
+        wx.CallAfter(
+            self.__search_done, generation, field, value, non_compliant, ids,
+            error)
+
+    def __search_done(self, generation, field, value, non_compliant, ids,
+                      error):
+        """
+        __search_done(self, int generation, str field, str value,
+        bool non_compliant, list ids, Exception error) - show search
+        results if they are still current
+        """
+        if generation != self.__search_generation:
+            return
+        if error is not None:
+            error_message_dialog(self, _("Search error"), error)
+            return
+        query = self.BASE_QUERY
+        if field is not None:
+            query = query.filter(glider_card_filter(field, value))
+        if non_compliant:
+            query = query.filter(non_compliant_filter())
+        self.__query_glider_card = query
+        self.datasource_glider_card = PagedDatasource(
+            self.__query_glider_card, GliderCard, ids)
+        self.__filtered = field is not None or non_compliant
+        self.RefreshGliderCard()
+
+    def SearchGliderCard(self, evt=None):
+        """
+        SearchGliderCard(self, Event evt=None) - filter glider card
+        according to competition number or registration
+        """
+        self.__search()
         self.list_glider_card.SetFocus()
 
     def AllGliderCard(self, evt=None):
@@ -1402,12 +1578,26 @@ SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.""")
         AllGliderCard(self, Event evt=None) - cancel filter glider card
         and show all data
         """
+        if self.__search_timer is not None:
+            self.__search_timer.Stop()
+        # Forget running search
+        self.__search_generation += 1
         if self.__filtered:
-            self.text_find.SetValue('')
-            self.datasource_glider_card = self.BASE_QUERY.all()
+            self.text_find.ChangeValue('')
+            self.cb_non_compliant.SetValue(False)
+            self.LoadGliderCards()
             self.__filtered = False
             self.RefreshGliderCard()
 
+    def __thumbnail_ready(self, photo):
+        """
+        __thumbnail_ready(self, Photo photo) - show generated thumbnail if
+        photo is still displayed
+        """
+        index = self.__current_photo_index
+        if index is not None and self.__photos[index] is photo:
+            self.photo.SetBitmap(GetPhotoBitmap(self.photo.ClientSize, photo))
+
     def __set_photo(self, index=None):
         """
         __set_photo(self, int index) - show photo thumbnail or empty photo
@@ -1415,8 +1605,11 @@ SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.""")
         """
         self.__current_photo_index = index
         if index is not None:
+            photo = self.__photos[index]
             self.photo.SetBitmap(
-                GetPhotoBitmap(self.photo.ClientSize, self.__photos[index]))
+                GetPhotoBitmap(
+                    self.photo.ClientSize, photo,
+                    lambda: self.__thumbnail_ready(photo)))
         else:
             self.photo.SetBitmap(
                 GetPhotoBitmap(self.photo.ClientSize))
@@ -2151,12 +2344,8 @@ class GliderCardForm(wx.Dialog):
                 self.__photo_changed = True
                 src_fullpath = abspath(dlg.GetPath())
                 settings.LAST_OPEN_FILE_PATH = dirname(src_fullpath)
-                # Sum MD5
-                f = open(src_fullpath, 'rb')
-                try:
-                    photo_md5 = md5(f.read()).hexdigest()
-                finally:
-                    f.close()
+                # Copy photo into photo store, MD5 is summed while copying
+                photo_md5 = add_photo_file(src_fullpath)
                 self.glidercard = getattr(self, 'glidercard', GliderCard())
                 # Does photo exist?
                 if [
@@ -2167,8 +2356,8 @@ class GliderCardForm(wx.Dialog):
                 # Add photo into database
                 photo = Photo(md5=photo_md5, main=False)
                 self.glidercard.photos.append(photo)
-                # Copy photo into photos dir
-                copy(src_fullpath, photo.full_path)
+                # Generate thumbnails in advance
+                PrepareThumbnail(photo)
                 # Show thumbnail
                 self.__set_photo(photo)
         finally:
@@ -2181,6 +2370,7 @@ class GliderCardForm(wx.Dialog):
         index = self.__current_photo_index
         photo = self.glidercard.photos[index]
         self.deleted_photos.append(photo.full_path)
+        thumbnails_cache.invalidate(photo.md5)
         session.delete(photo)
         del(self.glidercard.photos[index])
         count = len(self.glidercard.photos)
@@ -2220,6 +2410,17 @@ class GliderCardForm(wx.Dialog):
             index = count
         self.__set_photo(index=index)
 
+    def __thumbnail_ready(self, photo):
+        """
+        __thumbnail_ready(self, Photo photo) - show generated thumbnail if
+        dialog is still open and photo is displayed
+        """
+        if not self:
+            return
+        index = self.__current_photo_index
+        if index is not None and self.glidercard.photos[index] is photo:
+            self.photo.SetBitmap(GetPhotoBitmap(self.photo.ClientSize, photo))
+
     def __set_photo(self, photo=None, index=None):
         """
         __set_photo(self, Photo photo=None, int index=None) - show photo
@@ -2228,15 +2429,16 @@ class GliderCardForm(wx.Dialog):
         if photo is not None:
             self.__current_photo_index = [
                 p.md5 for p in self.glidercard.photos].index(photo.md5)
-            self.button_photo_set_main.Enable(not photo.main)
-            self.button_photo_delete.Enable(True)
-            self.photo.SetBitmap(GetPhotoBitmap(self.photo.ClientSize, photo))
         elif index is not None:
             self.__current_photo_index = index
             photo = self.glidercard.photos[index]
+        if photo is not None:
             self.button_photo_set_main.Enable(not photo.main)
             self.button_photo_delete.Enable(True)
-            self.photo.SetBitmap(GetPhotoBitmap(self.photo.ClientSize, photo))
+            self.photo.SetBitmap(
+                GetPhotoBitmap(
+                    self.photo.ClientSize, photo,
+                    lambda: self.__thumbnail_ready(photo)))
         else:
             self.__current_photo_index = None
             self.button_photo_set_main.Enable(False)
@@ -42,7 +42,7 @@ class PilotList(gui_dialogmodel.DialogModel):
             4, _("Sex"), 'sex', proportion=1)
 
         # Open data source
-        self.datasource = session.query(Pilot).all()
+        self.datasource = session.query(Pilot)
         count = len(self.datasource)
         if count > 0:
             self.Sort(2)
@@ -0,0 +1,143 @@
+"""
+GUI - Reports
+"""
+
+from datetime import date
+
+import wx
+from wx import GetTranslation as _
+
+from igcweight.database import session
+from igcweight.gui_widgets import VirtualListCtrl, TowBarStatus
+from igcweight.reports import daily_report, STATUS_NOT_WEIGHED
+
+
+class DailyReport(wx.Dialog):
+    """
+    Daily report dialog - tow bar status of all gliders for a day
+    """
+
+    SUMMARY = _(
+        "Weighed: %(weighed)d, not weighed: %(not_weighed)d, "
+        "out of the limit: %(out)d")
+
+    def __init__(self, *args, **kwds):
+        """
+        __init__(self, Window parent, int id=-1)
+        """
+        kwds["style"] = (
+            wx.DEFAULT_DIALOG_STYLE | wx.RESIZE_BORDER | wx.THICK_FRAME)
+        wx.Dialog.__init__(self, *args, **kwds)
+        self.label_date = wx.StaticText(self, -1, _("Date"))
+        self.date_picker = wx.DatePickerCtrl(
+            self, -1, style=wx.DP_DROPDOWN | wx.DP_SHOWCENTURY)
+        self.text_summary = wx.StaticText(self, -1, "")
+        self.list_report = VirtualListCtrl(self, -1)
+        self.list_report.GetItemTextMethod = self.__get_item_text
+        self.list_report.GetItemAttrMethod = self.__get_item_attr
+        self.button_close = wx.Button(self, wx.ID_CLOSE, "")
+
+        self.__tow_bar_status = TowBarStatus()
+
+        self.list_report.InsertColumn(
+            0, _("Competition number"), 'competition_number', proportion=3)
+        self.list_report.InsertColumn(
+            1, _("Registration"), 'registration', proportion=3)
+        self.list_report.InsertColumn(
+            2, _("Glider type"), 'glider_type', proportion=4)
+        self.list_report.InsertColumn(
+            3, _("Pilot"), 'pilot', proportion=6)
+        self.list_report.InsertColumn(
+            4, _("Time"), 'date', proportion=3)
+        self.list_report.InsertColumn(
+            5, _("Tow bar weight"), 'tow_bar_weight',
+            format=wx.LIST_FORMAT_RIGHT, proportion=3)
+        self.list_report.InsertColumn(
+            6, _("Status"), 'status', proportion=6)
+
+        self.__set_properties()
+        self.__do_layout()
+
+        # Bind events
+        self.Bind(wx.EVT_DATE_CHANGED, self.LoadReport, self.date_picker)
+        self.Bind(wx.EVT_BUTTON, self.__close, self.button_close)
+
+        self.LoadReport()
+
+    def __set_properties(self):
+        self.SetTitle(_("Daily report"))
+        self.SetEscapeId(wx.ID_CLOSE)
+        self.button_close.SetDefault()
+
+    def __do_layout(self):
+        sizer_main = wx.BoxSizer(wx.VERTICAL)
+        sizer_date = wx.BoxSizer(wx.HORIZONTAL)
+        sizer_date.Add(
+            self.label_date, 0, wx.RIGHT | wx.ALIGN_CENTER_VERTICAL, 4)
+        sizer_date.Add(self.date_picker, 0, wx.RIGHT, 8)
+        sizer_date.Add(
+            self.text_summary, 1, wx.LEFT | wx.ALIGN_CENTER_VERTICAL, 4)
+        sizer_main.Add(sizer_date, 0, wx.ALL | wx.EXPAND, 4)
+        sizer_main.Add(
+            self.list_report, 1, wx.LEFT | wx.RIGHT | wx.EXPAND, 4)
+        sizer_main.Add(self.button_close, 0, wx.ALL | wx.ALIGN_RIGHT, 4)
+        self.SetSizer(sizer_main)
+        self.Layout()
+        self.SetSize((850, 500))
+        self.SetMinSize(self.GetSize())
+        self.CenterOnParent()
+
+    def __close(self, evt):
+        """
+        __close(self, Event evt) - close dialog
+        """
+        self.EndModal(wx.ID_CLOSE)
+
+    @property
+    def day(self):
+        """
+        day -> date - return date chosen in date picker
+        """
+        value = self.date_picker.GetValue()
+        return date(value.GetYear(), value.GetMonth() + 1, value.GetDay())
+
+    def LoadReport(self, evt=None):
+        """
+        LoadReport(self, Event evt=None) - load report of chosen date
+        """
+        rows = daily_report(session.connection(), self.day)
+        not_weighed = len([
+            row for row in rows if row.status == STATUS_NOT_WEIGHED])
+        out = len([
+            row for row in rows if self.__tow_bar_status.out_of_limit(
+                row.status, row.club_class)])
+        self.text_summary.SetLabel(self.SUMMARY % {
+            'weighed': len(rows) - not_weighed, 'not_weighed': not_weighed,
+            'out': out})
+        self.list_report.datasource = rows
+        self.list_report.SetItemCount(len(rows))
+        self.list_report.Refresh()
+
+    def __get_item_text(self, item, colname):
+        """
+        __get_item_text(self, int item, str colname) -> str - return text
+        of report cell
+        """
+        row = self.list_report.datasource[item]
+        if colname == 'pilot':
+            return u"%s %s" % (row.firstname, row.surname)
+        elif colname == 'date':
+            return row.date.strftime('%X') if row.date is not None else ''
+        elif colname == 'status':
+            return self.__tow_bar_status.text(
+                row.status, row.difference, row.club_class)
+        value = getattr(row, colname)
+        return unicode(value) if value is not None else ''
+
+    def __get_item_attr(self, item):
+        """
+        __get_item_attr(self, int item) -> wx.ListItemAttr - return attr
+        of report item
+        """
+        row = self.list_report.datasource[item]
+        return self.__tow_bar_status.attr(row.status, row.club_class)
@@ -3,17 +3,193 @@ GUI widgets
 """
 
 import os
+import locale
+import threading
 
 from os.path import isfile
+from multiprocessing.pool import ThreadPool
+from decimal import Decimal
+from datetime import date, time
 
 import wx
 
 from wx import GetTranslation as _
 
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
 from igcweight import settings
+from igcweight.database import commit_count
+from igcweight.reports import (
+    STATUS_NOT_WEIGHED, STATUS_NO_DATA, STATUS_OVERWEIGHT,
+    STATUS_UNDERWEIGHT)
+
+
+# Number of records fetched by one query of paged datasource
+DATASOURCE_PAGE_SIZE = 200
+# Number of pages kept in memory by paged datasource
+DATASOURCE_PAGES = 8
+# Number of rows whose rendered cells are kept by list control
+RENDER_CACHE_SIZE = 1000
+# Number of threads generating photo thumbnails
+THUMBNAIL_THREADS = 2
+# Longest edges of thumbnails stored for every photo
+THUMBNAIL_LEVELS = (160, 320, 640, 1280)
+# Part of settings.IMG_CACHE_SIZE the thumbnails are trimmed to
+THUMBNAIL_TRIM_RATIO = 0.9
+
+
+class ThumbnailCache(object):
+    """
+    ThumbnailCache(int max_bytes) - LRU cache of photo bitmaps limited
+    by their memory size
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.__bitmaps = {}
+        self.__lru = []
+
+    def __len__(self):
+        return len(self.__bitmaps)
+
+    @staticmethod
+    def bitmap_size(bitmap):
+        """
+        bitmap_size(Bitmap bitmap) -> int - return approximate memory size
+        of bitmap
+        """
+        w, h = bitmap.GetSize()
+        return w * h * max(bitmap.GetDepth(), 8) / 8
+
+    def get(self, key):
+        """
+        get(self, tuple key) -> Bitmap - return cached bitmap, None if it
+        isn't cached
+        """
+        bitmap = self.__bitmaps.get(key)
+        if bitmap is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.__lru.remove(key)
+        self.__lru.append(key)
+        return bitmap
+
+    def put(self, key, bitmap):
+        """
+        put(self, tuple key, Bitmap bitmap) - cache bitmap, least recently
+        used bitmaps are dropped when cache exceeds its budget
+        """
+        self.remove(key)
+        self.__bitmaps[key] = bitmap
+        self.__lru.append(key)
+        self.size += self.bitmap_size(bitmap)
+        while self.size > self.max_bytes and len(self.__lru) > 1:
+            self.remove(self.__lru[0])
+
+    def remove(self, key):
+        """
+        remove(self, tuple key) - drop cached bitmap
+        """
+        bitmap = self.__bitmaps.pop(key, None)
+        if bitmap is not None:
+            self.__lru.remove(key)
+            self.size -= self.bitmap_size(bitmap)
+
+    def invalidate(self, md5):
+        """
+        invalidate(self, str md5) - drop all bitmaps of photo, e.g. when
+        it is deleted
+        """
+        for key in self.__bitmaps.keys():
+            if key[2] == md5:
+                self.remove(key)
+
+    def clear(self):
+        """
+        clear(self) - drop all bitmaps
+        """
+        self.__bitmaps.clear()
+        self.__lru = []
+        self.size = 0
+
+thumbnails_cache = ThumbnailCache(settings.THUMBNAILS_CACHE_SIZE)
+
+_thumbnail_pool = None
+_thumbnail_pending = {}
+_thumbnail_failed = set()
+_thumbnail_lock = threading.Lock()
+# Size of thumbnails directory, None until it is scanned
+_thumbnail_dir_size = None
+_thumbnail_trim_lock = threading.Lock()
+
+
+class TowBarStatus(object):
+    """
+    TowBarStatus() - texts and list item attributes of daily tow bar
+    weight status, shared by the main window and the daily report
+    """
+
+    OK = _("* In the limit")
+    OVERWEIGHT = _("! Overweight by %d kg")
+    UNDERWEIGHT = _("! Underweight by %d kg")
+    UNDERWEIGHT_NO_CLUB = _("* Underweight by %d kg, OK")
+    NO_DATA = _("? No data")
+    NOT_WEIGHED = _("? Not weighed")
 
+    COLOR_OK = 'DARK GREEN'
+    COLOR_OVERWEIGHT = 'RED'
+    COLOR_NO_DATA = 'BLUE'
 
-_thumbnails_cache = {}
+    def __init__(self):
+        self.attr_ok = wx.ListItemAttr(colText=self.COLOR_OK)
+        self.attr_overweight = wx.ListItemAttr(colText=self.COLOR_OVERWEIGHT)
+        self.attr_no_data = wx.ListItemAttr(colText=self.COLOR_NO_DATA)
+
+    def out_of_limit(self, status, club_class):
+        """
+        out_of_limit(self, str status, bool club_class) -> bool - return
+        True if status is out of the limit; underweight is allowed out of
+        club class
+        """
+        return (
+            status == STATUS_OVERWEIGHT or
+            (status == STATUS_UNDERWEIGHT and club_class))
+
+    def text(self, status, difference, club_class):
+        """
+        text(self, str status, int difference, bool club_class) -> str -
+        return text of status
+        """
+        if status == STATUS_NOT_WEIGHED:
+            return self.NOT_WEIGHED
+        elif status == STATUS_NO_DATA:
+            return self.NO_DATA
+        elif status == STATUS_OVERWEIGHT:
+            return self.OVERWEIGHT % abs(difference)
+        elif status == STATUS_UNDERWEIGHT:
+            t = self.UNDERWEIGHT if club_class else self.UNDERWEIGHT_NO_CLUB
+            return t % abs(difference)
+        else:
+            return self.OK
+
+    def attr(self, status, club_class):
+        """
+        attr(self, str status, bool club_class) -> wx.ListItemAttr - return
+        list item attr of status
+        """
+        if status in (STATUS_NOT_WEIGHED, STATUS_NO_DATA):
+            return self.attr_no_data
+        elif self.out_of_limit(status, club_class):
+            return self.attr_overweight
+        else:
+            return self.attr_ok
 
 
 def error_message_dialog(parent, message, exception=None):
@@ -36,43 +212,249 @@ def info_message_dialog(parent, message):
         message, _("Information"), wx.OK | wx.ICON_INFORMATION, parent)
 
 
-def GetPhotoBitmap(max_size, photo=None):
+def sort_key(value, text):
+    """
+    sort_key(value, unicode text) -> tuple - return sort key of column
+    value; empty values are first, numbers and dates are ordered
+    naturally, other values by locale collation of their text
+    """
+    if value is None or text == '':
+        return (0, )
+    if isinstance(value, (bool, int, long, float, Decimal, date, time)):
+        return (1, value)
+    if isinstance(text, unicode):
+        text = text.encode(locale.getpreferredencoding(False), 'replace')
+    return (2, locale.strxfrm(text))
+
+
+def thumbnail_level(max_size):
+    """
+    thumbnail_level(Size max_size) -> int - return the smallest thumbnail
+    level that fills max_size, the largest one if none does
+    """
+    needed = max(max_size)
+    for level in THUMBNAIL_LEVELS:
+        if level >= needed:
+            return level
+    return THUMBNAIL_LEVELS[-1]
+
+
+def thumbnail_path(level, md5):
+    """
+    thumbnail_path(int level, str md5) -> str - return path of photo
+    thumbnail file
+    """
+    return os.path.join(settings.IMG_CACHE_DIR, '%d-%s.jpg' % (level, md5))
+
+
+def _fit_size(image_size, max_size):
+    """
+    _fit_size(tuple image_size, tuple max_size) -> tuple - return image
+    size scaled down to fit max_size, keeping its proportion
+    """
+    image_w, image_h = image_size
+    max_w, max_h = max_size
+    if image_w > max_w or image_h > max_h:
+        image_proportion = float(image_w) / image_h
+        image_w = max_w
+        image_h = int(image_w / image_proportion)
+        if image_h > max_h:
+            image_h = max_h
+            image_w = int(image_h * image_proportion)
+    return image_w, image_h
+
+
+def _make_thumbnails(photo_path, md5, level):
+    """
+    _make_thumbnails(str photo_path, str md5, int level) -> int - scale
+    photo into thumbnail levels up to level, from the largest to the
+    smallest one, return size of written files
+    """
+    levels = sorted(
+        [l for l in THUMBNAIL_LEVELS if l <= level], reverse=True)
+    size = 0
+    if Image is not None:
+        image = Image.open(photo_path)
+        # Decode JPEG at the smallest DCT scale (1/2, 1/4 or 1/8) that is
+        # still larger than thumbnail, then resize it in high quality;
+        # the box keeps photo proportion, so the longest edge decides
+        image.draft('RGB', _fit_size(image.size, (levels[0], levels[0])))
+        image = image.convert('RGB')
+    else:
+        image = wx.Image(photo_path, type=wx.BITMAP_TYPE_JPEG)
+    for level in levels:
+        path = thumbnail_path(level, md5)
+        # Thumbnail must not be seen before it is complete
+        temp_path = '%s.tmp' % path
+        if Image is not None:
+            image.thumbnail((level, level), Image.ANTIALIAS)
+            image.save(temp_path, 'JPEG', quality=90)
+        else:
+            image_w, image_h = _fit_size(image.GetSize(), (level, level))
+            image.Rescale(image_w, image_h, quality=wx.IMAGE_QUALITY_HIGH)
+            image.SaveFile(temp_path, wx.BITMAP_TYPE_JPEG)
+        size += os.path.getsize(temp_path)
+        os.rename(temp_path, path)
+    return size
+
+
+def _scan_thumbnails():
+    """
+    _scan_thumbnails() -> (list files, int total) - return thumbnails
+    (mtime, size, path) and their total size
+    """
+    files = []
+    total = 0
+    for name in os.listdir(settings.IMG_CACHE_DIR):
+        if name.endswith('.tmp'):
+            # Thumbnail is being written
+            continue
+        path = os.path.join(settings.IMG_CACHE_DIR, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, path))
+        total += stat.st_size
+    return files, total
+
+
+def _trim_thumbnails(added):
+    """
+    _trim_thumbnails(int added) - count added bytes into running size of
+    thumbnails directory; when it exceeds settings.IMG_CACHE_SIZE, remove
+    least recently used thumbnails below THUMBNAIL_TRIM_RATIO of it, so
+    the directory is scanned only once per many thumbnails
+    """
+    global _thumbnail_dir_size
+    _thumbnail_trim_lock.acquire()
+    try:
+        if _thumbnail_dir_size is not None:
+            _thumbnail_dir_size += added
+            if _thumbnail_dir_size <= settings.IMG_CACHE_SIZE:
+                return
+        files, total = _scan_thumbnails()
+        if total > settings.IMG_CACHE_SIZE:
+            limit = settings.IMG_CACHE_SIZE * THUMBNAIL_TRIM_RATIO
+            files.sort()
+            for mtime, size, path in files:
+                if total <= limit:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                total -= size
+        _thumbnail_dir_size = total
+    finally:
+        _thumbnail_trim_lock.release()
+
+
+def _thumbnail_worker(photo_path, md5, level):
+    """
+    _thumbnail_worker(str photo_path, str md5, int level) - make
+    thumbnails on worker thread and notify waiting callbacks on GUI thread
+    """
+    try:
+        added = _make_thumbnails(photo_path, md5, level)
+        done = True
+    except Exception:
+        # Broken photo, placeholder is shown instead
+        added = 0
+        done = False
+    _thumbnail_lock.acquire()
+    try:
+        callbacks = _thumbnail_pending.pop(md5, [])
+        if not done:
+            # Don't decode broken photo again on every repaint
+            _thumbnail_failed.add(md5)
+    finally:
+        _thumbnail_lock.release()
+    _trim_thumbnails(added)
+    if done:
+        for callback in callbacks:
+            wx.CallAfter(callback)
+
+
+def PrepareThumbnail(photo, level=None, callback=None):
     """
-    GetPhotoBitmap(self, Size max_size, Photo photo=None) -> Bitmap -
-    load photo and return bitmap
+    PrepareThumbnail(Photo photo, int level=None, callable callback=None)
+    -> bool - return True if photo thumbnail of level (default the largest
+    one) exists, otherwise generate levels up to it on background thread
+    and call callback on GUI thread when they are ready; photos which
+    failed to decode aren't tried again
+    """
+    global _thumbnail_pool
+    if level is None:
+        level = THUMBNAIL_LEVELS[-1]
+    if isfile(thumbnail_path(level, photo.md5)):
+        return True
+    _thumbnail_lock.acquire()
+    try:
+        if photo.md5 in _thumbnail_failed:
+            return False
+        callbacks = _thumbnail_pending.get(photo.md5)
+        if callbacks is None:
+            callbacks = _thumbnail_pending[photo.md5] = []
+            if _thumbnail_pool is None:
+                _thumbnail_pool = ThreadPool(THUMBNAIL_THREADS)
+            _thumbnail_pool.apply_async(
+                _thumbnail_worker, (photo.full_path, photo.md5, level))
+        if callback is not None:
+            callbacks.append(callback)
+    finally:
+        _thumbnail_lock.release()
+    return False
+
+
+def ResetThumbnails():
+    """
+    ResetThumbnails() - forget size of thumbnails directory, photos which
+    failed to decode and cached bitmaps, e.g. when photos are cleaned or
+    imported
+    """
+    global _thumbnail_dir_size
+    _thumbnail_trim_lock.acquire()
+    try:
+        _thumbnail_dir_size = None
+    finally:
+        _thumbnail_trim_lock.release()
+    _thumbnail_lock.acquire()
+    try:
+        _thumbnail_failed.clear()
+    finally:
+        _thumbnail_lock.release()
+    thumbnails_cache.clear()
+
+
+def GetPhotoBitmap(max_size, photo=None, callback=None):
+    """
+    GetPhotoBitmap(self, Size max_size, Photo photo=None, callable
+    callback=None) -> Bitmap - load photo thumbnail and return bitmap; if
+    thumbnail isn't ready yet, return empty photo and call callback when
+    it's ready
     """
     ctrl_w, ctrl_h = max_size
-    key_name = (
-        photo is not None and
-        '%dx%d-%s' % (ctrl_w, ctrl_h, photo.md5) or
-        'empty-photo')
-    bitmap = None
-
-    if key_name not in _thumbnails_cache:
-        # Not cached, create bitmap from file
+    key = (ctrl_w, ctrl_h, photo is not None and photo.md5 or None)
+    bitmap = thumbnails_cache.get(key)
+
+    if bitmap is None:
         if photo is not None:
-            thumbnail_path = os.path.join(
-                settings.IMG_CACHE_DIR, '%s.jpg' % key_name)
-            if not isfile(thumbnail_path):
-                # if thumbnail doesn't exist, create it
-                image = wx.Image(photo.full_path, type=wx.BITMAP_TYPE_JPEG)
-                image_w, image_h = image.GetSize()
-                if image_w > ctrl_w or image_h > ctrl_h:
-                    # Count thumbnail size
-                    image_proportion = float(image_w) / image_h
-                    image_w = ctrl_w
-                    image_h = int(image_w / image_proportion)
-                    if image_h > ctrl_h:
-                        image_h = ctrl_h
-                        image_w = int(image_h * image_proportion)
-                    # Scale photo thumbnail
-                    image.Rescale(
-                        image_w, image_h, quality=wx.IMAGE_QUALITY_HIGH)
-                    image.SaveFile(thumbnail_path, wx.BITMAP_TYPE_JPEG)
-            else:
-                # Load thumbnail from file
-                image = wx.Image(thumbnail_path, type=wx.BITMAP_TYPE_JPEG)
-                image_w, image_h = image.GetSize()
+            level = thumbnail_level(max_size)
+            if not PrepareThumbnail(photo, level, callback):
+                # Show placeholder while thumbnail is being generated
+                return GetPhotoBitmap(max_size)
+            # Load the nearest larger thumbnail and scale it down
+            path = thumbnail_path(level, photo.md5)
+            image = wx.Image(path, type=wx.BITMAP_TYPE_JPEG)
+            image_w, image_h = _fit_size(image.GetSize(), (ctrl_w, ctrl_h))
+            if (image_w, image_h) != tuple(image.GetSize()):
+                image.Rescale(image_w, image_h)
+            # Mark thumbnail as recently used
+            try:
+                os.utime(path, None)
+            except OSError:
+                pass
         else:
             # Load empty photo
             image = wx.Image(
@@ -85,9 +467,118 @@ def GetPhotoBitmap(max_size, photo=None):
             (ctrl_w, ctrl_h), ((ctrl_w-image_w) / 2, (ctrl_h-image_h) / 2))
 
         bitmap = image.ConvertToBitmap()
+        thumbnails_cache.put(key, bitmap)
+
+    return bitmap
+
+
+class PagedDatasource(object):
+    """
+    PagedDatasource(Query query, class model, list ids=None) - lazy list
+    of query records; only primary keys are loaded in query order, records
+    are fetched by key sets in pages around requested rows; appended
+    records are kept even if they don't match query filter
+    """
+
+    def __init__(self, query, model, ids=None):
+        self.__query = query
+        self.__model = model
+        if ids is None:
+            ids = [row[0] for row in query.values(model.id)]
+        self.__ids = ids
+        self.__appended = {}
+        self.__pages = {}
+        self.__lru = []
+
+    def __len__(self):
+        return len(self.__ids)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.__ids)
+        if index < 0 or index >= len(self.__ids):
+            raise IndexError("datasource index out of range")
+        page = index // DATASOURCE_PAGE_SIZE
+        if page in self.__pages:
+            self.__lru.remove(page)
+        else:
+            self.__pages[page] = self.__fetch(page)
+            if len(self.__lru) >= DATASOURCE_PAGES:
+                del self.__pages[self.__lru.pop(0)]
+        self.__lru.append(page)
+        return self.__pages[page][index % DATASOURCE_PAGE_SIZE]
+
+    def __delitem__(self, index):
+        self.__appended.pop(self.__ids[index], None)
+        del self.__ids[index]
+        # Rows after deleted one are shifted
+        if index < 0:
+            index += len(self.__ids) + 1
+        self.__forget(index // DATASOURCE_PAGE_SIZE)
+
+    def __iter__(self):
+        for i in xrange(len(self.__ids)):
+            yield self[i]
+
+    def __contains__(self, item):
+        return item is not None and item.id in self.__ids
+
+    def __fetch(self, page):
+        """
+        __fetch(self, int page) -> list - load records of page, None if
+        record doesn't exist any more
+        """
+        start = page * DATASOURCE_PAGE_SIZE
+        ids = self.__ids[start:start+DATASOURCE_PAGE_SIZE]
+        records = dict(
+            (record.id, record) for record in self.__query.filter(
+                self.__model.id.in_(ids)).order_by(None))
+        missing = [
+            record_id for record_id in ids if record_id not in records]
+        for record_id in missing[:]:
+            if record_id in self.__appended:
+                records[record_id] = self.__appended[record_id]
+                missing.remove(record_id)
+        if missing:
+            # Records changed since ids were loaded don't match query filter
+            records.update(
+                (record.id, record) for record in
+                self.__query.session.query(self.__model).filter(
+                    self.__model.id.in_(missing)))
+        return [records.get(record_id) for record_id in ids]
+
+    def __forget(self, page):
+        """
+        __forget(self, int page) - drop cached pages from page to the end
+        """
+        for cached in self.__pages.keys():
+            if cached >= page:
+                del self.__pages[cached]
+                self.__lru.remove(cached)
+
+    def index(self, item):
+        """
+        index(self, db item item) -> int - return index of item
+        """
+        return self.__ids.index(item.id)
 
-    # Cache and return bitmap
-    return _thumbnails_cache.setdefault(key_name, bitmap)
+    def append(self, item):
+        """
+        append(self, db item item) - append new record
+        """
+        self.__ids.append(item.id)
+        self.__appended[item.id] = item
+        self.__forget((len(self.__ids) - 1) // DATASOURCE_PAGE_SIZE)
+
+    def sort(self, key):
+        """
+        sort(self, function key) - sort records in Python, all of them are
+        loaded
+        """
+        records = [record for record in self if record is not None]
+        records.sort(key=key)
+        self.__ids = [record.id for record in records]
+        self.__forget(0)
 
 
 class VirtualListCtrl(wx.ListCtrl):
@@ -101,6 +592,10 @@ class VirtualListCtrl(wx.ListCtrl):
 
         self.GetItemAttrMethod = None
         self.GetItemTextMethod = None
+        self.__datasource = None
+        self.__sort_keys = {}
+        self.__render_cache = {}
+        self.__render_version = None
         self.__columns = {}
         self.__column_sum = 0
 
@@ -133,6 +628,75 @@ class VirtualListCtrl(wx.ListCtrl):
         """
         return self.__columns[col]['fieldname']
 
+    def get_datasource(self):
+        """
+        datasource(self) -> list of db items or PagedDatasource
+        """
+        return self.__datasource
+
+    def set_datasource(self, value):
+        """
+        datasource(self, list value) - set datasource and forget its sort
+        keys
+        """
+        self.__datasource = value
+        self.__sort_keys.clear()
+        self.__render_cache.clear()
+    datasource = property(get_datasource, set_datasource)
+
+    def GetSortKey(self, row, colname):
+        """
+        GetSortKey(self, db item row, str colname) -> tuple - return cached
+        sort key of row column
+        """
+        key = (row, colname)
+        try:
+            return self.__sort_keys[key]
+        except KeyError:
+            value = sort_key(
+                getattr(row, colname), row.column_as_str(colname))
+            self.__sort_keys[key] = value
+            return value
+
+    def InvalidateSortKeys(self, row=None):
+        """
+        InvalidateSortKeys(self, db item row=None) - forget sort keys of
+        changed row, or all sort keys if row is None
+        """
+        if row is None:
+            self.__sort_keys.clear()
+        else:
+            for key in self.__sort_keys.keys():
+                if key[0] is row:
+                    del self.__sort_keys[key]
+
+    def InvalidateRenderCache(self):
+        """
+        InvalidateRenderCache(self) - forget rendered cells, e.g. when they
+        depend on changed preferences
+        """
+        self.__render_cache.clear()
+
+    def __render(self, item):
+        """
+        __render(self, int item) -> dict - return rendered cells of row,
+        texts are stored under column names and attr under None; cache is
+        dropped after every commit
+        """
+        version = commit_count()
+        if (version != self.__render_version or
+                len(self.__render_cache) >= RENDER_CACHE_SIZE):
+            self.__render_cache.clear()
+            self.__render_version = version
+        return self.__render_cache.setdefault(self.__datasource[item], {})
+
+    def SortDatasource(self, col):
+        """
+        SortDatasource(self, long col) - sort datasource by column
+        """
+        colname = self.__columns[col]['fieldname']
+        self.__datasource.sort(key=lambda row: self.GetSortKey(row, colname))
+
     def __OnResize(self, evt):
         """
         __OnResize(self, Event evt) - re-count grid columns size
@@ -161,10 +725,16 @@ class VirtualListCtrl(wx.ListCtrl):
         from datasource
         """
         colname = self.__columns[col]['fieldname']
-        if self.GetItemTextMethod is not None:
-            return self.GetItemTextMethod(item, colname)
-        else:
-            return self.datasource[item].column_as_str(colname)
+        cells = self.__render(item)
+        if colname not in cells:
+            if self.datasource[item] is None:
+                # Record was deleted in the meantime
+                cells[colname] = ''
+            elif self.GetItemTextMethod is not None:
+                cells[colname] = self.GetItemTextMethod(item, colname)
+            else:
+                cells[colname] = self.datasource[item].column_as_str(colname)
+        return cells[colname]
 
     def OnGetItemAttr(self, item):
         """
@@ -172,8 +742,13 @@ class VirtualListCtrl(wx.ListCtrl):
         item attr
         """
         if self.GetItemAttrMethod is not None:
-            self.__attr = self.GetItemAttrMethod(item)
-            return self.__attr
+            cells = self.__render(item)
+            if None not in cells:
+                if self.datasource[item] is None:
+                    cells[None] = None
+                else:
+                    cells[None] = self.GetItemAttrMethod(item)
+            return cells[None]
         else:
             return None
 
@@ -0,0 +1,274 @@
+"""
+Fleet-wide handicap computation
+"""
+
+from decimal import Decimal
+
+from sqlalchemy import select, not_
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from igcweight import settings
+from igcweight.database import engine
+from igcweight.models import GliderCard, GliderType, GliderCardStatus
+
+glider_card = GliderCard.__table__
+glider_type = GliderType.__table__
+glider_card_status = GliderCardStatus.__table__
+
+
+def _places(value):
+    """
+    _places(Decimal value) -> int - return number of decimal places
+    """
+    return max(0, -value.as_tuple().exponent)
+
+
+def _fixed(value, scale):
+    """
+    _fixed(Decimal value, int scale) -> int - return value as fixed-point
+    integer with scale decimal places
+    """
+    return int(value.scaleb(scale))
+
+
+def fleet_query(whereclause=None):
+    """
+    fleet_query(clause whereclause=None) -> Select - return query of
+    columns needed for handicap and weight statuses of glider cards
+    """
+    return select(
+        [glider_card.c.id, glider_card.c.glider_weight,
+         glider_card.c.pilot_weight, glider_card.c.landing_gear,
+         glider_card.c.winglets, glider_type.c.weight_referential,
+         glider_type.c.coefficient,
+         glider_card.c.certified_weight_non_lifting,
+         glider_card.c.certified_min_seat_weight,
+         glider_card.c.certified_max_seat_weight,
+         glider_type.c.weight_non_lifting, glider_type.c.mtow_without_water,
+         glider_type.c.mtow],
+        whereclause,
+        from_obj=[glider_card.join(
+            glider_type,
+            glider_card.c.glider_type_id == glider_type.c.id)])
+
+
+def _coefficients_numpy(rows, handicaps, scale):
+    """
+    _coefficients_numpy(list rows, dict handicaps, int scale) -> list -
+    count fixed-point coefficients of rows as arrays, None where data are
+    missing
+    """
+    count = len(rows)
+    valid = numpy.array([
+        row[1] is not None and row[2] is not None and
+        row[5] is not None and row[6] is not None for row in rows],
+        dtype=bool)
+    values = numpy.array([
+        [row[1] or 0, row[2] or 0, row[5] or 0,
+         row[3] and 1 or 0, row[4] and 1 or 0] for row in rows],
+        dtype=numpy.int64).reshape((count, 5))
+    coefficient = numpy.array([
+        row[6] is not None and _fixed(row[6], scale) or 0 for row in rows],
+        dtype=numpy.int64)
+    difference = values[:, 0] + values[:, 1] - values[:, 2]
+    over_step = handicaps['overweight_step']
+    under_step = handicaps['underweight_step']
+    weight_handicap = numpy.where(
+        difference > 0,
+        (difference + over_step - 1) // over_step *
+        handicaps['overweight_handicap'],
+        numpy.where(
+            difference < 0,
+            -(numpy.abs(difference) // under_step *
+              handicaps['underweight_handicap']),
+            0))
+    result = (
+        coefficient + values[:, 3] * handicaps['gear_handicap'] +
+        values[:, 4] * handicaps['winglets_handicap'] + weight_handicap)
+    return [
+        int(value) if is_valid else None
+        for is_valid, value in zip(valid.tolist(), result.tolist())]
+
+
+def _coefficients_python(rows, handicaps, scale):
+    """
+    _coefficients_python(list rows, dict handicaps, int scale) -> list -
+    count fixed-point coefficients of rows one by one, None where data
+    are missing
+    """
+    result = []
+    for row in rows:
+        (card_id, glider_weight, pilot_weight, landing_gear, winglets,
+         weight_referential, coefficient) = row[:7]
+        if (glider_weight is None or pilot_weight is None or
+                weight_referential is None or coefficient is None):
+            result.append(None)
+            continue
+        difference = glider_weight + pilot_weight - weight_referential
+        if difference > 0:
+            step = handicaps['overweight_step']
+            weight_handicap = (
+                (difference + step - 1) // step *
+                handicaps['overweight_handicap'])
+        elif difference < 0:
+            weight_handicap = -(
+                abs(difference) // handicaps['underweight_step'] *
+                handicaps['underweight_handicap'])
+        else:
+            weight_handicap = 0
+        value = _fixed(coefficient, scale) + weight_handicap
+        if landing_gear:
+            value += handicaps['gear_handicap']
+        if winglets:
+            value += handicaps['winglets_handicap']
+        result.append(value)
+    return result
+
+
+def _coefficients(rows, configuration):
+    """
+    _coefficients(list rows, Configuration configuration) -> list - return
+    coefficients of fleet query rows, None if weights are missing
+    """
+    if not rows:
+        return []
+    decimals = dict(
+        (name, getattr(configuration, name)) for name in (
+            'gear_handicap', 'winglets_handicap', 'overweight_handicap',
+            'underweight_handicap'))
+    # All values are counted with the largest number of decimal places
+    scale = max(
+        [_places(value) for value in decimals.values()] +
+        [_places(row[6]) for row in rows if row[6] is not None])
+    handicaps = dict(
+        (name, _fixed(value, scale)) for name, value in decimals.items())
+    handicaps['overweight_step'] = configuration.overweight_step
+    handicaps['underweight_step'] = configuration.underweight_step
+    if numpy is not None:
+        values = _coefficients_numpy(rows, handicaps, scale)
+    else:
+        values = _coefficients_python(rows, handicaps, scale)
+    return [
+        Decimal(value).scaleb(-scale) if value is not None else None
+        for value in values]
+
+
+def fleet_coefficients(connection, configuration=None, whereclause=None):
+    """
+    fleet_coefficients(Connection connection, Configuration
+    configuration=None, clause whereclause=None) -> dict - return
+    competition coefficient of every glider card by its id, None if weights
+    are missing; values are equal to GliderCard.coefficient, they are
+    counted in fixed-point integers (by NumPy if it is available) from one
+    query
+    """
+    if configuration is None:
+        configuration = settings.configuration
+    rows = connection.execute(fleet_query(whereclause)).fetchall()
+    return dict(
+        (row[0], value)
+        for row, value in zip(rows, _coefficients(rows, configuration)))
+
+
+def _status(row, coefficient):
+    """
+    _status(RowProxy row, Decimal coefficient) -> dict - return weight
+    differences of fleet query row, they are equal to GliderCard properties
+    """
+    (card_id, glider_weight, pilot_weight, landing_gear, winglets,
+     weight_referential, type_coefficient, certified_weight_non_lifting,
+     certified_min_seat_weight, certified_max_seat_weight,
+     weight_non_lifting, mtow_without_water, mtow) = row
+    if glider_weight is not None and pilot_weight is not None:
+        referential_weight = glider_weight + pilot_weight
+    else:
+        referential_weight = None
+    status = {
+        'id': card_id,
+        'coefficient': coefficient,
+        'non_lifting_difference': None,
+        'mtow_difference': None,
+        'seat_weight_difference': None,
+        'referential_difference': None,
+    }
+    if (certified_weight_non_lifting is not None and
+            weight_non_lifting is not None):
+        status['non_lifting_difference'] = (
+            certified_weight_non_lifting - weight_non_lifting)
+    if mtow_without_water is not None:
+        mtow = mtow_without_water
+    if referential_weight is not None and mtow is not None:
+        status['mtow_difference'] = referential_weight - mtow
+    if (certified_min_seat_weight is not None and
+            certified_max_seat_weight is not None and
+            pilot_weight is not None):
+        if pilot_weight < certified_min_seat_weight:
+            status['seat_weight_difference'] = (
+                pilot_weight - certified_min_seat_weight)
+        elif pilot_weight > certified_max_seat_weight:
+            status['seat_weight_difference'] = (
+                pilot_weight - certified_max_seat_weight)
+        else:
+            status['seat_weight_difference'] = 0
+    if referential_weight is not None and weight_referential is not None:
+        status['referential_difference'] = (
+            referential_weight - weight_referential)
+    # Non-compliant are statuses displayed as overweight in glider card
+    overweight = [
+        difference for difference in (
+            status['non_lifting_difference'], status['mtow_difference'],
+            status['referential_difference'])
+        if difference is not None and difference > 0]
+    status['compliant'] = (
+        not overweight and status['seat_weight_difference'] in (None, 0))
+    return status
+
+
+def update_status(connection, whereclause=None, configuration=None):
+    """
+    update_status(Connection connection, clause whereclause=None,
+    Configuration configuration=None) - count weight statuses and
+    coefficients of glider cards selected by whereclause (all if it is
+    None) and store them into glider_card_status table
+    """
+    if configuration is None:
+        configuration = settings.configuration
+    rows = connection.execute(fleet_query(whereclause)).fetchall()
+    if whereclause is None:
+        connection.execute(glider_card_status.delete())
+    elif not rows:
+        # Statuses of deleted glider cards are deleted by foreign key
+        return
+    else:
+        connection.execute(glider_card_status.delete(
+            glider_card_status.c.id.in_(
+                select([glider_card.c.id], whereclause))))
+    if rows:
+        connection.execute(glider_card_status.insert(), [
+            _status(row, coefficient) for row, coefficient in zip(
+                rows, _coefficients(rows, configuration))])
+
+
+def _install_status():
+    """
+    _install_status() - count statuses of glider cards which haven't them,
+    e.g. in database created by older version
+    """
+    connection = engine.connect()
+    try:
+        trans = connection.begin()
+        try:
+            update_status(connection, not_(glider_card.c.id.in_(
+                select([glider_card_status.c.id]))))
+            trans.commit()
+        except:
+            trans.rollback()
+            raise
+    finally:
+        connection.close()
+
+_install_status()
@@ -3,208 +3,704 @@ Import and export data module
 """
 
 import re
-import codecs
 
-from os.path import join, isdir
+from os.path import isdir
 from os import mkdir
-from shutil import copyfileobj, rmtree
+from shutil import rmtree
 from datetime import datetime
-from tarfile import open as taropen
-from xml.dom.minidom import getDOMImplementation, parse
+from time import time
+from tarfile import open as taropen, TarInfo
+from tempfile import SpooledTemporaryFile
+from mmap import mmap, ACCESS_READ, ALLOCATIONGRANULARITY
+from xml.sax.saxutils import XMLGenerator
+from xml.sax.xmlreader import AttributesImpl
+from xml.etree.cElementTree import iterparse
+from zlib import compressobj, decompressobj, DEFLATED, MAX_WBITS
+from bz2 import compress as bz2_compress, BZ2Decompressor
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
+from wx import GetTranslation as _
+
+from sqlalchemy import select, bindparam, func, and_, not_
 
 from igcweight import settings
+from igcweight.photostore import (
+    PACK_NAME, PACK_INDEX_NAME, store_photo, pack_index, write_pack_index,
+    read_pack_index, PackReader, MappedSlice)
 
 from igcweight.database import session
 from igcweight.models import (
-    GliderCard, Pilot, Organization, GliderType, Photo, DailyWeight)
+    GliderCard, Pilot, Organization, GliderType, Photo, DailyWeight,
+    ChangeJournal, journal_changes)
 from igcweight.configuration import Configuration
+from igcweight.handicap import update_status
 
 patternt_tar = re.compile(r'^.+\.tar$', re.IGNORECASE)
 patternt_jpg = re.compile(r'^[a-z0-9]{32,32}\.jpg$', re.IGNORECASE)
+patternt_xml = re.compile(r'^igcweight\.xml(\.(gz|bz2))?$')
 
 MODELS = (Organization, Pilot, GliderType, GliderCard, Photo, DailyWeight)
+PREFERENCES = (
+    'gear_handicap', 'winglets_handicap', 'overweight_handicap',
+    'overweight_step', 'underweight_handicap', 'underweight_step',
+    'allowed_difference')
+EXPORT_YIELD_PER = 500
+IMPORT_BATCH_SIZE = 500
+XML_SPOOL_SIZE = 16 * 1024 * 1024
+COMPRESS_CHUNK_SIZE = 1024 * 1024
+DECOMPRESS_CHUNK_SIZE = 64 * 1024
+
+
+def _gzip_compress(data):
+    """
+    _gzip_compress(str data) -> str - compress data into gzip member
+    """
+    compressor = compressobj(9, DEFLATED, 16 + MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _gzip_decompressor():
+    """
+    _gzip_decompressor() -> decompressor - return gzip member decompressor
+    """
+    return decompressobj(16 + MAX_WBITS)
+
+COMPRESSIONS = {
+    'gz': (_gzip_compress, _gzip_decompressor),
+    'bz2': (bz2_compress, BZ2Decompressor),
+}
+
+
+class _DecompressReader(object):
+    """
+    _DecompressReader(file fileobj, callable decompressor) - read-only file
+    object which decompresses data of concatenated compressed streams
+    """
+
+    def __init__(self, fileobj, decompressor):
+        self.fileobj = fileobj
+        self.decompressor = decompressor
+        self.current = decompressor()
+        self.pending = ''
+        self.buffer = ''
+        self.eof = False
+
+    def __decompress(self, data):
+        """
+        __decompress(self, str data) -> str - decompress data, start new
+        decompressor when current stream is finished
+        """
+        try:
+            out = self.current.decompress(data)
+        except EOFError:
+            # Previous stream ended just at the end of read data
+            self.current = self.decompressor()
+            out = self.current.decompress(data)
+        if self.current.unused_data:
+            self.pending = self.current.unused_data
+            self.current = self.decompressor()
+        return out
+
+    def read(self, size=-1):
+        """
+        read(self, int size=-1) -> str - read decompressed data
+        """
+        while not self.eof and (size < 0 or len(self.buffer) < size):
+            if self.pending:
+                data, self.pending = self.pending, ''
+            else:
+                data = self.fileobj.read(DECOMPRESS_CHUNK_SIZE)
+                if not data:
+                    self.eof = True
+                    break
+            self.buffer += self.__decompress(data)
+        if size < 0:
+            data, self.buffer = self.buffer, ''
+        else:
+            data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def close(self):
+        """
+        close(self) - close underlying file
+        """
+        self.fileobj.close()
+
+
+def _processes():
+    """
+    _processes() -> int - return number of worker threads
+    """
+    try:
+        return cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+def _compress(src, dst, compression):
+    """
+    _compress(file src, file dst, str compression) - compress src into
+    dst, chunks are compressed as independent streams on worker threads
+    """
+    compress = COMPRESSIONS[compression][0]
+    processes = _processes()
+    pool = ThreadPool(processes)
+    try:
+        while True:
+            chunks = []
+            for i in range(processes * 2):
+                data = src.read(COMPRESS_CHUNK_SIZE)
+                if not data:
+                    break
+                chunks.append(data)
+            if not chunks:
+                break
+            for data in pool.imap(compress, chunks):
+                dst.write(data)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _write_element(xml, name, value):
+    """
+    _write_element(XMLGenerator xml, str name, str value) - write simple
+    element with text content
+    """
+    xml.startElement(name, AttributesImpl({}))
+    xml.characters(value)
+    xml.endElement(name)
+
+
+def _changed_ids(table_name, since, deleted=False):
+    """
+    _changed_ids(str table_name, int since, bool deleted=False) -> Select -
+    return query of row ids changed (or deleted) after journal id since
+    """
+    journal = ChangeJournal.__table__
+    query = select(
+        [journal.c.row_id],
+        and_(journal.c.id > since, journal.c.table_name == table_name),
+        distinct=True)
+    if deleted:
+        query = query.where(journal.c.deleted == True)
+    return query
+
+
+def LastJournalId():
+    """
+    LastJournalId() -> int - return id of the last change journal entry
+    """
+    journal = ChangeJournal.__table__
+    return session.execute(select([func.max(journal.c.id)])).scalar() or 0
+
+
+def _export_query(model, since=None):
+    """
+    _export_query(Model model, int since=None) -> Query - return query of
+    exported rows, only rows changed after journal id since if it is set
+    """
+    query = session.query(model)
+    if since is not None:
+        query = query.filter(
+            model.id.in_(_changed_ids(model.__table__.name, since)))
+    return query
+
+
+def ChangedPhotos(since):
+    """
+    ChangedPhotos(int since) -> Query - return photos inserted or updated
+    after journal id since, e.g. by import
+    """
+    return _export_query(Photo, since)
 
 
-def Export(fullpath):
+def _export_xml(f, journal, since=None):
     """
-    Export(str fullpath) - export data into archive file
+    _export_xml(file f, int journal, int since=None) - write data as XML
+    into file, rows are streamed from database straight into the output;
+    only rows changed after journal id since are written if it is set
     """
-    # Create XML
-    impl = getDOMImplementation()
-    xml = impl.createDocument(None, "igcweight", None)
-    top_element = xml.documentElement
+    xml = XMLGenerator(f, 'utf-8')
+    xml.startDocument()
+    xml.startElement('igcweight', AttributesImpl({}))
     # Add metadata into XML
-    meta = xml.createElement('meta')
-    element = xml.createElement('date')
-    element.appendChild(
-        xml.createTextNode(datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-    meta.appendChild(element)
-    element = xml.createElement('version')
-    element.appendChild(
-        xml.createTextNode(".".join(str(s) for s in settings.VERSION_DB)))
-    meta.appendChild(element)
-    top_element.appendChild(meta)
+    xml.startElement('meta', AttributesImpl({}))
+    _write_element(xml, 'date', datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+    _write_element(
+        xml, 'version', ".".join(str(s) for s in settings.VERSION_DB))
+    _write_element(xml, 'database', settings.configuration.database_id)
+    _write_element(xml, 'journal', str(journal))
+    if since is not None:
+        _write_element(xml, 'baseline', str(since))
+    xml.endElement('meta')
     # Add preferences into XML
-    preferences = xml.createElement('preferences')
-    element = xml.createElement('gear_handicap')
-    element.appendChild(
-        xml.createTextNode(str(settings.configuration.gear_handicap)))
-    preferences.appendChild(element)
-    element = xml.createElement('winglets_handicap')
-    element.appendChild(
-        xml.createTextNode(str(settings.configuration.winglets_handicap)))
-    preferences.appendChild(element)
-    element = xml.createElement('overweight_handicap')
-    element.appendChild(
-        xml.createTextNode(str(settings.configuration.overweight_handicap)))
-    preferences.appendChild(element)
-    element = xml.createElement('overweight_step')
-    element.appendChild(
-        xml.createTextNode(str(settings.configuration.overweight_step)))
-    preferences.appendChild(element)
-    element = xml.createElement('underweight_handicap')
-    element.appendChild(
-        xml.createTextNode(str(settings.configuration.underweight_handicap)))
-    preferences.appendChild(element)
-    element = xml.createElement('underweight_step')
-    element.appendChild(
-        xml.createTextNode(str(settings.configuration.underweight_step)))
-    preferences.appendChild(element)
-    element = xml.createElement('allowed_difference')
-    element.appendChild(
-        xml.createTextNode(str(settings.configuration.allowed_difference)))
-    preferences.appendChild(element)
-    top_element.appendChild(preferences)
+    xml.startElement('preferences', AttributesImpl({}))
+    for name in PREFERENCES:
+        _write_element(
+            xml, name, str(getattr(settings.configuration, name)))
+    xml.endElement('preferences')
+    # Add deleted rows into XML before models data, so rows re-created
+    # with the same unique values don't collide with the deleted ones on
+    # import; children are deleted before parents
+    if since is not None:
+        for model in reversed(MODELS):
+            table_name = model.__table__.name
+            xml.startElement('delete', AttributesImpl(
+                {'name': table_name, 'type': model.__name__}))
+            query = _changed_ids(table_name, since, deleted=True).where(
+                not_(ChangeJournal.__table__.c.row_id.in_(
+                    select([model.__table__.c.id]))))
+            for row in session.execute(query):
+                xml.startElement(table_name, AttributesImpl({}))
+                _write_element(xml, 'id', str(row[0]))
+                xml.endElement(table_name)
+            xml.endElement('delete')
     # Add models data into XML
     for model in MODELS:
-        model_name = model.__name__
         table_name = model.__table__.name
-        element_table = xml.createElement('model')
-        attribute = xml.createAttribute('name')
-        element_table.setAttributeNode(attribute)
-        element_table.setAttribute('name', table_name)
-        attribute = xml.createAttribute('type')
-        element_table.setAttributeNode(attribute)
-        element_table.setAttribute('type', model_name)
-        query = session.query(model).all()
-        for row in query:
-            element_row = xml.createElement(table_name)
-            for column in model.__table__.columns:
-                column_name = column.key
-                element = xml.createElement(column_name)
-                element.appendChild(
-                    xml.createTextNode(row.column_as_str(column_name, False)))
-                element_row.appendChild(element)
-            element_table.appendChild(element_row)
-        top_element.appendChild(element_table)
-    # Save XML
-    f = codecs.open(settings.XML_DATA, 'w', encoding='utf-8')
+        columns = [column.key for column in model.__table__.columns]
+        xml.startElement('model', AttributesImpl(
+            {'name': table_name, 'type': model.__name__}))
+        query = _export_query(model, since)
+        for row in query.yield_per(EXPORT_YIELD_PER):
+            xml.startElement(table_name, AttributesImpl({}))
+            for column_name in columns:
+                _write_element(
+                    xml, column_name, row.column_as_str(column_name, False))
+            xml.endElement(table_name)
+        xml.endElement('model')
+    xml.endElement('igcweight')
+    xml.endDocument()
+
+
+def _export_pack(tar, query):
+    """
+    _export_pack(TarFile tar, Query query) - add photos of query into
+    archive as one photo pack and its index
+    """
+    entries, size = pack_index(
+        [photo.md5 for photo in query.yield_per(EXPORT_YIELD_PER)])
+    index = SpooledTemporaryFile(max_size=XML_SPOOL_SIZE)
+    try:
+        write_pack_index(index, entries)
+        info = TarInfo(PACK_INDEX_NAME)
+        info.size = index.tell()
+        info.mtime = time()
+        index.seek(0)
+        tar.addfile(info, index)
+    finally:
+        index.close()
+    info = TarInfo(PACK_NAME)
+    info.size = size
+    info.mtime = time()
+    src = PackReader(entries)
     try:
-        xml.writexml(f, encoding='utf-8')
+        tar.addfile(info, src)
     finally:
-        f.close()
+        src.close()
 
-    # Create TAR
-    tar = taropen(fullpath, 'w')
+
+def Export(fullpath, compression=None, baseline=None, pack=None):
+    """
+    Export(str fullpath, str compression=None, str baseline=None,
+    bool pack=None) - export data into archive file, XML data are
+    compressed when compression is 'gz' or 'bz2'; when baseline archive is
+    set, only data changed since the baseline are exported, the baseline
+    must be exported from this database; photos are stored as one photo
+    pack when pack is True, default is settings.EXPORT_PHOTO_PACK
+    """
+    if pack is None:
+        pack = settings.EXPORT_PHOTO_PACK
+    since = None
+    journal = LastJournalId()
+    if baseline is not None:
+        meta = ReadMeta(baseline)
+        since = meta.get('journal')
+        # Journal ids are valid only in the database which wrote them
+        if (since is None or
+                meta.get('database') != settings.configuration.database_id or
+                int(since) > journal):
+            raise Exception(
+                _("Archive %s can't be used as a baseline") % baseline)
+        since = int(since)
+    # Create XML in memory, large data are spooled into temporary file
+    xml = SpooledTemporaryFile(max_size=XML_SPOOL_SIZE)
     try:
-        tar.add(settings.XML_DATA, 'igcweight.xml')
-        query = session.query(Photo).all()
-        for photo in query:
-            tar.add(str(photo.full_path), str(photo.file_name))
+        _export_xml(xml, journal, since)
+        member_name = 'igcweight.xml'
+        if compression is not None:
+            xml.seek(0)
+            compressed = SpooledTemporaryFile(max_size=XML_SPOOL_SIZE)
+            try:
+                _compress(xml, compressed, compression)
+            except:
+                compressed.close()
+                raise
+            xml.close()
+            xml = compressed
+            member_name = '%s.%s' % (member_name, compression)
+        info = TarInfo(member_name)
+        info.size = xml.tell()
+        info.mtime = time()
+        xml.seek(0)
+
+        # Create TAR
+        tar = taropen(fullpath, 'w')
+        try:
+            tar.addfile(info, xml)
+            query = _export_query(Photo, since)
+            if pack:
+                _export_pack(tar, query)
+            else:
+                for photo in query.yield_per(EXPORT_YIELD_PER):
+                    tar.add(str(photo.full_path), str(photo.file_name))
+        finally:
+            tar.close()
     finally:
-        tar.close()
+        xml.close()
+
+
+def _import_preferences(element):
+    """
+    _import_preferences(Element element) - store preferences from XML
+    element into configuration
+    """
+    try:
+        for child in element:
+            if child.tag in PREFERENCES and child.text:
+                getattr(settings.configuration, 'set_%s' % child.tag)(
+                    unicode(child.text))
+        settings.configuration.save()
+    except:
+        settings.configuration.read()
+        raise
+
+
+class _BulkWriter(object):
+    """
+    _BulkWriter(Connection connection) - collect imported rows and write
+    them into database in batches, one model after another
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.model = None
+        self.delete = False
+        self.rows = []
+        self.count = 0
+
+    def add(self, model, row, delete=False):
+        """
+        add(self, Model model, dict row, bool delete=False) - add row to be
+        stored (or deleted), full batch is written
+        """
+        if model is not self.model or delete != self.delete:
+            self.flush()
+            self.model = model
+            self.delete = delete
+        self.rows.append(row)
+        if len(self.rows) >= IMPORT_BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        """
+        flush(self) - write collected rows, existing primary keys are
+        resolved by one query and updated, the others are inserted
+        """
+        if not self.rows:
+            return
+        table = self.model.__table__
+        pk = table.c.id
+        ids = [row['id'] for row in self.rows if row['id'] is not None]
+        if self.delete:
+            self.connection.execute(table.delete().where(pk.in_(ids)))
+            journal_changes(self.connection, table.name, ids, deleted=True)
+            self.count += len(self.rows)
+            self.rows = []
+            return
+        existing = set()
+        if ids:
+            existing = set(
+                r[0] for r in self.connection.execute(
+                    select([pk], pk.in_(ids))))
+        inserts = []
+        updates = []
+        for row in self.rows:
+            if row['id'] in existing:
+                row['_id'] = row['id']
+                updates.append(row)
+            else:
+                inserts.append(row)
+        if inserts:
+            self.connection.execute(table.insert(), inserts)
+        if updates:
+            self.connection.execute(
+                table.update().where(pk == bindparam('_id')), updates)
+        journal_changes(
+            self.connection, table.name, [row['id'] for row in self.rows])
+        self.count += len(self.rows)
+        self.rows = []
+
+
+def _import_xml(src):
+    """
+    _import_xml(file src) -> int - parse XML data incrementally and store
+    rows into database in batches, return number of imported rows
+    """
+    writer = _BulkWriter(session.connection())
+    root = None
+    table = None
+    model_obj = None
+    depth = 0
+    try:
+        for event, element in iterparse(src, events=('start', 'end')):
+            if event == 'start':
+                depth += 1
+                if depth == 1:
+                    root = element
+                elif depth == 2 and element.tag in ('model', 'delete'):
+                    table = element
+                    model_obj = globals()[element.get('type')]
+                continue
+            level = depth
+            depth -= 1
+            if level == 3 and table is not None:
+                # Data row
+                record = model_obj()
+                for attr in element:
+                    if attr.text:
+                        record.str_to_column(
+                            attr.tag, unicode(attr.text), use_locale=False)
+                writer.add(model_obj, dict(
+                    (column.key, getattr(record, column.key, None))
+                    for column in model_obj.__table__.columns),
+                    delete=table.tag == 'delete')
+                # Forget processed row, memory stays constant
+                table.remove(element)
+            elif level == 2:
+                if element.tag == 'preferences':
+                    _import_preferences(element)
+                elif element.tag in ('model', 'delete'):
+                    table = None
+                    model_obj = None
+                root.remove(element)
+        writer.flush()
+        update_status(session.connection())
+        session.commit()
+    except:
+        session.rollback()
+        raise
+    return writer.count
+
+
+def _store_photo(src, name, size):
+    """
+    _store_photo(file src, str name, int size) -> bool - copy photo from
+    src into photo store, MD5 hash in the name is verified while copying;
+    return False if the same photo already exists
+    """
+    return store_photo(src, name[:32].lower(), size)[1]
+
+
+def _extract_photo(args):
+    """
+    _extract_photo(tuple args) -> bool - copy photo stored at offset of
+    archive file into photos directory, args are (fullpath, name, offset,
+    size)
+    """
+    fullpath, name, offset, size = args
+    src = open(fullpath, 'rb')
+    try:
+        src.seek(offset)
+        return _store_photo(src, name, size)
+    finally:
+        src.close()
+
+
+def _import_photos(fullpath, tar, members):
+    """
+    _import_photos(str fullpath, TarFile tar, list members) - copy photos
+    from archive into photos directory, members of uncompressed archive
+    are copied on worker threads
+    """
+    if isinstance(tar.fileobj, file):
+        pool = ThreadPool(_processes())
+        try:
+            pool.map(_extract_photo, [
+                (fullpath, member.name, member.offset_data, member.size)
+                for member in members])
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for member in members:
+            src = tar.extractfile(member)
+            try:
+                _store_photo(src, member.name, member.size)
+            finally:
+                src.close()
+
+
+def _store_mapped_photo(args):
+    """
+    _store_mapped_photo(tuple args) -> bool - copy photo from memory
+    mapped archive into photo store, args are (mapping, md5, offset, size)
+    """
+    mapping, photo_md5, offset, size = args
+    return store_photo(MappedSlice(mapping, offset, size), photo_md5, size)[1]
+
+
+def _import_pack(fullpath, tar, member, entries):
+    """
+    _import_pack(str fullpath, TarFile tar, TarInfo member, list entries)
+    - copy photos from photo pack into photo store; pack of uncompressed
+    archive is memory mapped and photos are copied on worker threads
+    """
+    mapping = None
+    if isinstance(tar.fileobj, file):
+        # Only the pack is mapped, the mapping has to start at a multiple
+        # of allocation granularity
+        start = member.offset_data - (
+            member.offset_data % ALLOCATIONGRANULARITY)
+        f = open(fullpath, 'rb')
+        try:
+            mapping = mmap(
+                f.fileno(), member.offset_data - start + member.size,
+                access=ACCESS_READ, offset=start)
+        except EnvironmentError:
+            # Address space of 32-bit process may be exhausted, the pack
+            # is read sequentially then
+            mapping = None
+        finally:
+            f.close()
+    if mapping is not None:
+        try:
+            pool = ThreadPool(_processes())
+            try:
+                pool.map(_store_mapped_photo, [
+                    (mapping, photo_md5,
+                     member.offset_data - start + offset, size)
+                    for photo_md5, offset, size in entries])
+            finally:
+                pool.close()
+                pool.join()
+        finally:
+            mapping.close()
+    else:
+        src = tar.extractfile(member)
+        try:
+            for photo_md5, offset, size in sorted(
+                    entries, key=lambda entry: entry[1]):
+                src.seek(offset)
+                store_photo(src, photo_md5, size)
+        finally:
+            src.close()
 
 
 def Import(fullpath, overwrite=False):
     """
-    Import(str fullpath, overwrite=False) - import data from archive file
+    Import(str fullpath, overwrite=False) -> (int rows, float seconds) -
+    import data from archive file, return number of imported rows and
+    time spent
     """
+    rows = 0
+    started = time()
     # Open TAR
     tar = taropen(fullpath, 'r')
     try:
-        for file in tar.getnames():
-            if file == 'igcweight.xml':
+        photos = []
+        pack = None
+        pack_entries = []
+        for member in tar.getmembers():
+            match = patternt_xml.search(member.name)
+            if match:
                 # Import data
-                src = tar.extractfile(file)
+                src = tar.extractfile(member)
+                if match.group(2):
+                    src = _DecompressReader(
+                        src, COMPRESSIONS[match.group(2)][1])
                 try:
-                    document = parse(src)
-                    # Preferences
-                    preferences = document.getElementsByTagName('preferences')
-                    if len(preferences) == 1:
-                        try:
-                            for element in preferences[0].childNodes:
-                                if element.nodeName == 'gear_handicap':
-                                    if (element.firstChild and
-                                            element.firstChild.nodeValue):
-                                        settings.configuration.set_gear_handicap(
-                                            element.firstChild.nodeValue)
-                                if element.nodeName == 'winglets_handicap':
-                                    if (element.firstChild and
-                                            element.firstChild.nodeValue):
-                                        settings.configuration.set_winglets_handicap(
-                                            element.firstChild.nodeValue)
-                                if element.nodeName == 'overweight_handicap':
-                                    if (element.firstChild and
-                                            element.firstChild.nodeValue):
-                                        settings.configuration.set_overweight_handicap(
-                                            element.firstChild.nodeValue)
-                                if element.nodeName == 'overweight_step':
-                                    if (element.firstChild and
-                                            element.firstChild.nodeValue):
-                                        settings.configuration.set_overweight_step(
-                                            element.firstChild.nodeValue)
-                                if element.nodeName == 'underweight_handicap':
-                                    if (element.firstChild and
-                                            element.firstChild.nodeValue):
-                                        settings.configuration.set_underweight_handicap(
-                                            element.firstChild.nodeValue)
-                                if element.nodeName == 'underweight_step':
-                                    if (element.firstChild and
-                                            element.firstChild.nodeValue):
-                                        settings.configuration.set_underweight_step(
-                                            element.firstChild.nodeValue)
-                                if element.nodeName == 'allowed_difference':
-                                    if (element.firstChild and
-                                            element.firstChild.nodeValue):
-                                        settings.configuration.set_allowed_difference(
-                                            element.firstChild.nodeValue)
-                            settings.configuration.save()
-                        except:
-                            settings.configuration.read()
-                            raise
-                    # Data
-                    for model in document.getElementsByTagName('model'):
-                        model_name = model.attributes['type'].value
-                        table_name = model.attributes['name'].value
-                        model_obj = globals()[model_name]
-                        for row in model.getElementsByTagName(table_name):
-                            record = model_obj()
-                            for attr in row.childNodes:
-                                if (
-                                        attr.firstChild and
-                                        attr.firstChild.nodeValue):
-                                    record.str_to_column(
-                                        attr.nodeName,
-                                        attr.firstChild.nodeValue,
-                                        use_locale=False)
-                            session.merge(record)
-                            session.flush()
-                    session.commit()
+                    rows += _import_xml(src)
                 finally:
                     src.close()
-            if patternt_jpg.search(file):
-                # Import photos
-                dst = open(join(settings.PHOTOS_DIR, file), 'wb')
+            if patternt_jpg.search(member.name):
+                photos.append(member)
+            if member.name == PACK_INDEX_NAME:
+                src = tar.extractfile(member)
                 try:
-                    src = tar.extractfile(file)
-                    try:
-                        copyfileobj(src, dst)
-                    finally:
-                        src.close()
+                    pack_entries = read_pack_index(src)
                 finally:
-                    dst.close()
+                    src.close()
+            if member.name == PACK_NAME:
+                pack = member
+        # Import photos
+        _import_photos(fullpath, tar, photos)
+        if pack is not None:
+            _import_pack(fullpath, tar, pack, pack_entries)
     finally:
         tar.close()
+    return rows, time() - started
+
+
+def ReadMeta(fullpath):
+    """
+    ReadMeta(str fullpath) -> dict - read metadata from archive file
+    """
+    meta = {}
+    tar = taropen(fullpath, 'r')
+    try:
+        for file in tar.getnames():
+            match = patternt_xml.search(file)
+            if match:
+                src = tar.extractfile(file)
+                if match.group(2):
+                    src = _DecompressReader(
+                        src, COMPRESSIONS[match.group(2)][1])
+                try:
+                    for event, element in iterparse(src):
+                        if element.tag == 'meta':
+                            for child in element:
+                                meta[child.tag] = child.text
+                            break
+                finally:
+                    src.close()
+                break
+    finally:
+        tar.close()
+    return meta
+
+
+def ImportChain(fullpaths, overwrite=False):
+    """
+    ImportChain(list fullpaths, overwrite=False) -> (int rows, float
+    seconds) - import full archive and chain of incremental archives
+    created on top of it, return number of imported rows and time spent
+    """
+    archives = []
+    for fullpath in fullpaths:
+        meta = ReadMeta(fullpath)
+        journal = meta.get('journal')
+        baseline = meta.get('baseline')
+        archives.append((
+            int(baseline) if baseline is not None else -1,
+            int(journal) if journal is not None else 0,
+            fullpath))
+    archives.sort()
+    # Check there is no gap in the chain
+    for previous, current in zip(archives, archives[1:]):
+        if current[0] > previous[1]:
+            raise Exception(
+                _("Archive %(current)s doesn't follow %(previous)s") % {
+                    'current': current[2], 'previous': previous[2]})
+    rows = 0
+    seconds = 0
+    for baseline, journal, fullpath in archives:
+        r, s = Import(fullpath, overwrite)
+        rows += r
+        seconds += s
+    return rows, seconds
 
 
 def CleanDb(models, preferences, measured_weights):
@@ -214,10 +710,16 @@ def CleanDb(models, preferences, measured_weights):
     """
     try:
         for model in models:
+            journal_changes(
+                session.connection(), model.__table__.name,
+                [row[0] for row in session.query(model.id)], deleted=True)
             session.query(model).delete()
             session.flush()
 
         if measured_weights:
+            journal_changes(
+                session.connection(), GliderCard.__table__.name,
+                [row[0] for row in session.query(GliderCard.id)])
             session.query(
                 GliderCard
             ).update(
@@ -240,3 +742,13 @@ def CleanDb(models, preferences, measured_weights):
 
     if preferences:
         Configuration(settings.CONFIG_FILE, force_defaults=True)
+        settings.configuration.read()
+
+    if measured_weights or preferences:
+        # Weights and handicaps of remaining glider cards are changed
+        try:
+            update_status(session.connection())
+            session.commit()
+        except:
+            session.rollback()
+            raise
@@ -7,7 +7,6 @@ import locale
 import decimal
 import types
 
-from os.path import join
 from datetime import date, time, datetime
 
 from wx import GetTranslation as _
@@ -18,12 +17,14 @@ from sqlalchemy import (
     Integer, SmallInteger, String, Text, DateTime, Numeric, Boolean, CHAR)
 from sqlalchemy import (
     PrimaryKeyConstraint, UniqueConstraint, ForeignKeyConstraint)
-from sqlalchemy import desc
+from sqlalchemy import desc, select, case, func, literal, null, type_coerce
 from sqlalchemy.orm import MapperExtension, EXT_CONTINUE
 from sqlalchemy.orm import relation
+from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy import types as sqltypes
 
 from igcweight import settings
+from igcweight.photostore import photo_path
 
 pat = re.compile(r"\%s" % locale.localeconv()['decimal_point'])
 
@@ -50,6 +51,41 @@ def get_short_description(description, length):
     return l > length and '%s...' % description[0:length-3] or description
 
 
+def derived_property(*sources):
+    """
+    derived_property(str source, ...) -> function - decorator of hybrid
+    property which is counted once and cached until values of source
+    attributes (e.g. 'glider_weight' or 'glider_type.mtow') or
+    configuration change; SQL expression of the class attribute is set by
+    its expression decorator
+    """
+    paths = [source.split('.') for source in sources]
+
+    def decorator(fget):
+        name = fget.__name__
+
+        def getter(self):
+            signature = [settings.configuration.version]
+            for path in paths:
+                value = self
+                for attr in path:
+                    value = getattr(value, attr, None)
+                signature.append(value)
+            cache = self.__dict__.setdefault('_derived_cache', {})
+            cached = cache.get(name)
+            if cached is not None and cached[0] == signature:
+                return cached[1]
+            value = fget(self)
+            cache[name] = (signature, value)
+            return value
+
+        getter.__name__ = name
+        getter.__doc__ = fget.__doc__
+        return hybrid_property(getter)
+
+    return decorator
+
+
 class Conversion():
 
     def column_as_str(self, columnname, use_locale=True):
@@ -147,6 +183,57 @@ class Conversion():
 Base = declarative_base()
 
 
+class ChangeJournal(Base):
+    """
+    Model ChangeJournal - journal of inserted, updated and deleted rows,
+    used for incremental export
+    """
+
+    __table__ = Table(
+        'change_journal', Base.metadata,
+        Column(
+            'change_journal_id', Integer,
+            Sequence('change_journal_seq', optional=True),
+            key='id', nullable=False),
+        Column('table_name', String(30), nullable=False),
+        Column('row_id', Integer, nullable=False),
+        Column('deleted', Boolean, nullable=False),
+        PrimaryKeyConstraint('id', name='pk_change_journal')
+    )
+
+    def __repr__(self):
+        return "<ChangeJournal: #%s %s %s>" % (
+            str(self.id), self.table_name, str(self.row_id))
+
+
+def journal_changes(connection, table_name, ids, deleted=False):
+    """
+    journal_changes(Connection connection, str table_name, list ids,
+    bool deleted=False) - record changed rows into change journal
+    """
+    if ids:
+        connection.execute(
+            ChangeJournal.__table__.insert(),
+            [{'table_name': table_name, 'row_id': row_id,
+              'deleted': deleted} for row_id in ids])
+
+
+class JournalExtensions(MapperExtension):
+
+    def after_insert(self, mapper, connection, instance):
+        journal_changes(connection, instance.__table__.name, [instance.id])
+        return EXT_CONTINUE
+
+    def after_update(self, mapper, connection, instance):
+        journal_changes(connection, instance.__table__.name, [instance.id])
+        return EXT_CONTINUE
+
+    def after_delete(self, mapper, connection, instance):
+        journal_changes(
+            connection, instance.__table__.name, [instance.id], deleted=True)
+        return EXT_CONTINUE
+
+
 class OrganizationExtensions(MapperExtension):
 
     def before_delete(self, mapper, connection, instance):
@@ -177,7 +264,8 @@ class Organization(Base, Conversion):
         UniqueConstraint('code', name='uq_organization_code')
     )
 
-    __mapper_args__ = {'extension': OrganizationExtensions()}
+    __mapper_args__ = {
+        'extension': [OrganizationExtensions(), JournalExtensions()]}
 
     def __init__(self, **kwargs):
         """
@@ -243,7 +331,8 @@ class Pilot(Base, Conversion):
             name='uq_pilot_name')
     )
 
-    __mapper_args__ = {'extension': PilotExtensions()}
+    __mapper_args__ = {
+        'extension': [PilotExtensions(), JournalExtensions()]}
 
     def __init__(self, **kwargs):
         """
@@ -306,6 +395,12 @@ class GliderTypeExtensions(MapperExtension):
             raise Exception(_("Glider type is being used in the glider card!"))
         return EXT_CONTINUE
 
+    def after_update(self, mapper, connection, instance):
+        from handicap import update_status
+        update_status(
+            connection, GliderCard.__table__.c.glider_type_id == instance.id)
+        return EXT_CONTINUE
+
 
 class GliderType(Base, Conversion):
     """
@@ -330,7 +425,8 @@ class GliderType(Base, Conversion):
         UniqueConstraint('name', name='uq_glider_type_name')
     )
 
-    __mapper_args__ = {'extension': GliderTypeExtensions()}
+    __mapper_args__ = {
+        'extension': [GliderTypeExtensions(), JournalExtensions()]}
 
     def __init__(self, **kwargs):
         """
@@ -375,6 +471,35 @@ class GliderType(Base, Conversion):
         return self.club_class and _("Club") or ""
 
 
+def glider_type_value(glider_type_id, key):
+    """
+    glider_type_value(clause glider_type_id, str key) -> clause - return
+    scalar subquery of glider type column, glider type table is aliased so
+    the subquery is correlated only to glider_type_id
+    """
+    glider_type = GliderType.__table__.alias()
+    return select(
+        [glider_type.c[key]], glider_type.c.id == glider_type_id).as_scalar()
+
+
+def integer_division(numerator, denominator):
+    """
+    integer_division(clause numerator, int denominator) -> clause - return
+    quotient of non-negative numerator rounded down; the remainder is
+    subtracted first, because / is integer division in SQLite, but exact
+    division in MySQL
+    """
+    return (numerator - numerator % denominator) / denominator
+
+
+def decimal_literal(value):
+    """
+    decimal_literal(Decimal value) -> clause - return bound Decimal value,
+    it is converted for databases without native decimals
+    """
+    return literal(value, Numeric())
+
+
 class Photo(Base, Conversion):
     """
     Model Photo
@@ -395,6 +520,8 @@ class Photo(Base, Conversion):
             name='fk_photo_glider_card')
     )
 
+    __mapper_args__ = {'extension': JournalExtensions()}
+
     def __init__(self, **kwargs):
         """
         Photo(self, GliderCard glider_card=None, bool main=None,
@@ -426,7 +553,7 @@ class Photo(Base, Conversion):
         """
         Returns photo full path
         """
-        return join(settings.PHOTOS_DIR, self.file_name)
+        return photo_path(self.md5)
 
 
 class DailyWeight(Base, Conversion):
@@ -451,6 +578,8 @@ class DailyWeight(Base, Conversion):
             name='fk_daily_weight_glider_card')
     )
 
+    __mapper_args__ = {'extension': JournalExtensions()}
+
     def __init__(self, **kwargs):
         """
         GliderCard(self, GliderCard glider_card=None, date date=None,
@@ -484,6 +613,19 @@ class DailyWeight(Base, Conversion):
             return None
 
 
+class GliderCardExtensions(MapperExtension):
+
+    def after_insert(self, mapper, connection, instance):
+        from handicap import update_status
+        update_status(connection, GliderCard.__table__.c.id == instance.id)
+        return EXT_CONTINUE
+
+    def after_update(self, mapper, connection, instance):
+        from handicap import update_status
+        update_status(connection, GliderCard.__table__.c.id == instance.id)
+        return EXT_CONTINUE
+
+
 class GliderCard(Base, Conversion):
     """
     Model GliderCard
@@ -527,6 +669,9 @@ class GliderCard(Base, Conversion):
         UniqueConstraint('pilot_id', name='uq_glider_card_pilot')
     )
 
+    __mapper_args__ = {
+        'extension': [GliderCardExtensions(), JournalExtensions()]}
+
     glider_type = relation(GliderType, order_by=GliderType.name)
     pilot = relation(Pilot, order_by=Pilot.surname)
     organization = relation(Organization, order_by=Organization.name)
@@ -582,7 +727,7 @@ class GliderCard(Base, Conversion):
                     return p
         return None
 
-    @property
+    @derived_property('glider_weight', 'pilot_weight')
     def referential_weight(self):
         """
         referential_weight -> int or None - return competition referential
@@ -593,7 +738,12 @@ class GliderCard(Base, Conversion):
         else:
             return None
 
-    @property
+    @referential_weight.expression
+    def referential_weight(cls):
+        return cls.glider_weight + cls.pilot_weight
+
+    @derived_property(
+        'glider_weight', 'pilot_weight', 'glider_type.weight_referential')
     def referential_difference(self):
         """
         referential_difference -> int or None - return difference between
@@ -606,7 +756,15 @@ class GliderCard(Base, Conversion):
         else:
             return None
 
-    @property
+    @referential_difference.expression
+    def referential_difference(cls):
+        return (
+            cls.referential_weight -
+            glider_type_value(cls.glider_type_id, 'weight_referential'))
+
+    @derived_property(
+        'glider_weight', 'pilot_weight', 'landing_gear', 'winglets',
+        'glider_type.weight_referential', 'glider_type.coefficient')
     def coefficient(self):
         """
         coefficient -> int or None - return competition coefficient
@@ -644,7 +802,39 @@ class GliderCard(Base, Conversion):
         else:
             return None
 
-    @property
+    @coefficient.expression
+    def coefficient(cls):
+        # Handicaps of current configuration are bound into expression
+        configuration = settings.configuration
+        difference = cls.referential_difference
+        overweight_step = configuration.overweight_step
+        underweight_step = configuration.underweight_step
+        weight_handicap = case([
+            (difference > 0,
+             integer_division(
+                 difference + (overweight_step - 1), overweight_step) *
+             decimal_literal(configuration.overweight_handicap)),
+            (difference < 0,
+             (0 - integer_division(0 - difference, underweight_step)) *
+             decimal_literal(configuration.underweight_handicap))],
+            else_=0)
+        gear_handicap = case([
+            (cls.landing_gear == True,
+             decimal_literal(configuration.gear_handicap))],
+            else_=0)
+        winglets_handicap = case([
+            (cls.winglets == True,
+             decimal_literal(configuration.winglets_handicap))],
+            else_=0)
+        return type_coerce(case([
+            (difference == None, null())],
+            else_=(
+                glider_type_value(cls.glider_type_id, 'coefficient') +
+                gear_handicap + winglets_handicap + weight_handicap)),
+            Numeric(precision=6, scale=4))
+
+    @derived_property(
+        'certified_weight_non_lifting', 'glider_type.weight_non_lifting')
     def non_lifting_difference(self):
         """
         non_lifting_difference -> int or None - return difference between
@@ -658,7 +848,15 @@ class GliderCard(Base, Conversion):
         else:
             return None
 
-    @property
+    @non_lifting_difference.expression
+    def non_lifting_difference(cls):
+        return (
+            cls.certified_weight_non_lifting -
+            glider_type_value(cls.glider_type_id, 'weight_non_lifting'))
+
+    @derived_property(
+        'glider_weight', 'pilot_weight', 'glider_type.mtow',
+        'glider_type.mtow_without_water')
     def mtow_difference(self):
         """
         mtow_difference -> int or None - return difference between measured
@@ -677,7 +875,15 @@ class GliderCard(Base, Conversion):
         else:
             return None
 
-    @property
+    @mtow_difference.expression
+    def mtow_difference(cls):
+        return cls.referential_weight - func.coalesce(
+            glider_type_value(cls.glider_type_id, 'mtow_without_water'),
+            glider_type_value(cls.glider_type_id, 'mtow'))
+
+    @derived_property(
+        'pilot_weight', 'certified_min_seat_weight',
+        'certified_max_seat_weight')
     def seat_weight_difference(self):
         """
         seat_weight_difference -> int or None - return difference between
@@ -695,6 +901,45 @@ class GliderCard(Base, Conversion):
         else:
             return None
 
+    @seat_weight_difference.expression
+    def seat_weight_difference(cls):
+        return case([
+            ((cls.certified_min_seat_weight == None) |
+             (cls.certified_max_seat_weight == None) |
+             (cls.pilot_weight == None), null()),
+            (cls.pilot_weight < cls.certified_min_seat_weight,
+             cls.pilot_weight - cls.certified_min_seat_weight),
+            (cls.pilot_weight > cls.certified_max_seat_weight,
+             cls.pilot_weight - cls.certified_max_seat_weight)],
+            else_=0)
+
+
+class GliderCardStatus(Base):
+    """
+    Model GliderCardStatus - weight differences, coefficient and compliance
+    of glider card stored for filtering in database, rows are maintained
+    by igcweight.handicap.update_status
+    """
+
+    __table__ = Table(
+        'glider_card_status', Base.metadata,
+        Column('glider_card_id', Integer, key='id', nullable=False),
+        Column('non_lifting_difference', SmallInteger),
+        Column('mtow_difference', SmallInteger),
+        Column('seat_weight_difference', SmallInteger),
+        Column('referential_difference', SmallInteger),
+        Column('coefficient', Numeric(precision=6, scale=4)),
+        Column('compliant', Boolean, nullable=False, index=True),
+        PrimaryKeyConstraint('id', name='pk_glider_card_status'),
+        ForeignKeyConstraint(
+            ('id',), ('glider_card.id',),
+            name='fk_glider_card_status_glider_card', ondelete='CASCADE')
+    )
+
+    def __repr__(self):
+        return "<GliderCardStatus: #%s, %s>" % (
+            str(self.id), self.compliant and 'compliant' or 'non-compliant')
+
 
 from database import engine
 
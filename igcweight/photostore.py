@@ -0,0 +1,239 @@
+"""
+Photo store, photos are stored under their MD5 hash in sharded directories
+"""
+
+import re
+import errno
+
+from os import listdir, makedirs, fdopen, remove, rename
+from os.path import join, isdir, isfile, getsize, dirname
+from hashlib import md5
+from tempfile import mkstemp
+
+from wx import GetTranslation as _
+
+from igcweight import settings
+
+PHOTO_CHUNK_SIZE = 64 * 1024
+PACK_NAME = 'photos.pack'
+PACK_INDEX_NAME = 'photos.idx'
+
+patternt_photo = re.compile(r'^[0-9a-f]{32}\.jpg$')
+
+
+def photo_path(photo_md5):
+    """
+    photo_path(str photo_md5) -> str - return path of photo file,
+    e.g. PHOTOS_DIR/ab/cd/abcd....jpg
+    """
+    return join(
+        settings.PHOTOS_DIR, photo_md5[0:2], photo_md5[2:4],
+        '%s.jpg' % photo_md5)
+
+
+def photo_md5(fullpath):
+    """
+    photo_md5(str fullpath) -> str - return MD5 hash of file content
+    """
+    hash_md5 = md5()
+    f = open(fullpath, 'rb')
+    try:
+        for data in iter(lambda: f.read(PHOTO_CHUNK_SIZE), ''):
+            hash_md5.update(data)
+    finally:
+        f.close()
+    return hash_md5.hexdigest()
+
+
+def _move_into_store(tmp_path, photo_md5):
+    """
+    _move_into_store(str tmp_path, str photo_md5) - rename complete
+    temporary file to photo path
+    """
+    dst_path = photo_path(photo_md5)
+    if not isdir(dirname(dst_path)):
+        try:
+            makedirs(dirname(dst_path))
+        except OSError, e:
+            # Photos sharing the shard are stored by more threads
+            if e.errno != errno.EEXIST:
+                raise
+    if isfile(dst_path):
+        remove(dst_path)
+    rename(tmp_path, dst_path)
+
+
+def store_photo(src, expected_md5=None, size=None):
+    """
+    store_photo(file src, str expected_md5=None, int size=None) ->
+    (str md5, bool stored) - copy photo from src into store, MD5 hash is
+    counted while copying in chunks; if expected_md5 is given, it is
+    verified and stored photo of the same name and size isn't copied
+    again, otherwise stored photo with the same content is kept and the
+    copy is dropped
+    """
+    if expected_md5 is not None:
+        dst_path = photo_path(expected_md5)
+        # Photo is named by its content, so name and size are trusted and
+        # the stored photo isn't read; it is hashed only if size is unknown
+        if isfile(dst_path) and (
+                getsize(dst_path) == size if size is not None
+                else photo_md5(dst_path) == expected_md5):
+            return expected_md5, False
+    fd, tmp_path = mkstemp(suffix='.tmp', dir=settings.PHOTOS_DIR)
+    try:
+        dst = fdopen(fd, 'wb')
+        try:
+            hash_md5 = md5()
+            remaining = size
+            while remaining is None or remaining > 0:
+                chunk = PHOTO_CHUNK_SIZE
+                if remaining is not None:
+                    chunk = min(chunk, remaining)
+                data = src.read(chunk)
+                if not data:
+                    break
+                hash_md5.update(data)
+                dst.write(data)
+                if remaining is not None:
+                    remaining -= len(data)
+        finally:
+            dst.close()
+        stored_md5 = hash_md5.hexdigest()
+        if expected_md5 is not None and stored_md5 != expected_md5:
+            raise Exception(_("Photo %s is corrupted") % expected_md5)
+        if expected_md5 is None and isfile(photo_path(stored_md5)):
+            remove(tmp_path)
+            return stored_md5, False
+        _move_into_store(tmp_path, stored_md5)
+    except:
+        if isfile(tmp_path):
+            remove(tmp_path)
+        raise
+    return stored_md5, True
+
+
+def add_photo_file(fullpath):
+    """
+    add_photo_file(str fullpath) -> str - copy photo file into store and
+    return its MD5 hash
+    """
+    src = open(fullpath, 'rb')
+    try:
+        return store_photo(src)[0]
+    finally:
+        src.close()
+
+
+def pack_index(md5s):
+    """
+    pack_index(list md5s) -> (list entries, int size) - return pack index
+    entries (md5, offset, size) of photos stored one after another and
+    total pack size
+    """
+    entries = []
+    offset = 0
+    for photo_md5 in md5s:
+        size = getsize(photo_path(photo_md5))
+        entries.append((photo_md5, offset, size))
+        offset += size
+    return entries, offset
+
+
+def write_pack_index(dst, entries):
+    """
+    write_pack_index(file dst, list entries) - write pack index, one
+    'md5 offset size' line per photo
+    """
+    for entry in entries:
+        dst.write('%s %d %d\n' % entry)
+
+
+def read_pack_index(src):
+    """
+    read_pack_index(file src) -> list - read pack index entries
+    (md5, offset, size)
+    """
+    entries = []
+    for line in src.read().splitlines():
+        if line:
+            photo_md5, offset, size = line.split()
+            entries.append((photo_md5.lower(), int(offset), int(size)))
+    return entries
+
+
+class PackReader(object):
+    """
+    PackReader(list entries) - file-like reader of photo pack, photos of
+    index entries are read one after another
+    """
+
+    def __init__(self, entries):
+        self.__md5s = [entry[0] for entry in entries]
+        self.__md5s.reverse()
+        self.__file = None
+
+    def read(self, size=-1):
+        """
+        read(self, int size=-1) -> str - read data of photos
+        """
+        chunks = []
+        while size != 0:
+            if self.__file is None:
+                if not self.__md5s:
+                    break
+                self.__file = open(photo_path(self.__md5s.pop()), 'rb')
+            data = self.__file.read(size)
+            if not data or size < 0:
+                self.__file.close()
+                self.__file = None
+            if data:
+                chunks.append(data)
+                if size > 0:
+                    size -= len(data)
+        return ''.join(chunks)
+
+    def close(self):
+        """
+        close(self) - close currently read photo
+        """
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+        self.__md5s = []
+
+
+class MappedSlice(object):
+    """
+    MappedSlice(mmap mapping, int offset, int size) - file-like reader of
+    a part of memory mapped file, it doesn't move the mapping position so
+    slices can be read by more threads
+    """
+
+    def __init__(self, mapping, offset, size):
+        self.__mapping = mapping
+        self.__pos = offset
+        self.__end = offset + size
+
+    def read(self, size=-1):
+        """
+        read(self, int size=-1) -> str - read data from slice
+        """
+        if size < 0:
+            end = self.__end
+        else:
+            end = min(self.__pos + size, self.__end)
+        data = self.__mapping[self.__pos:end]
+        self.__pos = end
+        return data
+
+
+def _migrate():
+    """
+    _migrate() - move photos from flat photos directory into shards
+    """
+    for name in listdir(settings.PHOTOS_DIR):
+        if patternt_photo.search(name):
+            _move_into_store(join(settings.PHOTOS_DIR, name), name[:32])
+
+_migrate()
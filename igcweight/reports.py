@@ -0,0 +1,112 @@
+"""
+Reports counted by database queries
+"""
+
+from datetime import datetime, time, timedelta
+
+from sqlalchemy import select, func, case, literal, and_
+
+from igcweight import settings
+
+from igcweight.models import GliderCard, GliderType, Pilot, DailyWeight
+
+STATUS_NOT_WEIGHED = 'not_weighed'
+STATUS_NO_DATA = 'no_data'
+STATUS_OK = 'ok'
+STATUS_OVERWEIGHT = 'overweight'
+STATUS_UNDERWEIGHT = 'underweight'
+
+glider_card = GliderCard.__table__
+glider_type = GliderType.__table__
+pilot = Pilot.__table__
+daily_weight = DailyWeight.__table__
+
+
+class DailyReportRow(object):
+    """
+    DailyReportRow(RowProxy row) - row of daily report, columns are
+    accessible as attributes
+    """
+
+    def __init__(self, row):
+        self.__dict__.update(row.items())
+
+    def __repr__(self):
+        return "<DailyReportRow: #%s %s>" % (
+            str(self.glider_card_id), self.status)
+
+
+def tow_bar_status(difference, allowed_difference=None):
+    """
+    tow_bar_status(int difference, int allowed_difference=None) -> str -
+    return status of daily weight differing from glider card tow bar weight
+    by difference, None difference has no data; the same rule as status
+    column of daily_report_query
+    """
+    if allowed_difference is None:
+        allowed_difference = settings.configuration.allowed_difference
+    if difference is None:
+        return STATUS_NO_DATA
+    elif difference > allowed_difference:
+        return STATUS_OVERWEIGHT
+    elif difference < -allowed_difference:
+        return STATUS_UNDERWEIGHT
+    else:
+        return STATUS_OK
+
+
+def daily_report_query(day, allowed_difference=None):
+    """
+    daily_report_query(date day, int allowed_difference=None) -> Select -
+    return query of tow bar status of every glider card; the last daily
+    weight of the day is compared with glider card tow bar weight, glider
+    cards without daily weight are not weighed
+    """
+    if allowed_difference is None:
+        allowed_difference = settings.configuration.allowed_difference
+    start = datetime.combine(day, time())
+    end = start + timedelta(days=1)
+    # The last daily weight of every glider card weighed on the day
+    other = daily_weight.alias()
+    last = select(
+        [func.max(other.c.date)],
+        and_(other.c.glider_card_id == daily_weight.c.glider_card_id,
+             other.c.date >= start, other.c.date < end)
+    ).as_scalar()
+    weighed = select(
+        [daily_weight.c.glider_card_id, daily_weight.c.date,
+         daily_weight.c.tow_bar_weight],
+        daily_weight.c.date == last
+    ).alias('weighed')
+    difference = weighed.c.tow_bar_weight - glider_card.c.tow_bar_weight
+    status = case([
+        (weighed.c.glider_card_id == None, literal(STATUS_NOT_WEIGHED)),
+        (glider_card.c.tow_bar_weight == None, literal(STATUS_NO_DATA)),
+        (difference > allowed_difference, literal(STATUS_OVERWEIGHT)),
+        (difference < -allowed_difference, literal(STATUS_UNDERWEIGHT))],
+        else_=literal(STATUS_OK))
+    return select(
+        [glider_card.c.id.label('glider_card_id'),
+         glider_card.c.competition_number, glider_card.c.registration,
+         glider_type.c.name.label('glider_type'), glider_type.c.club_class,
+         pilot.c.firstname, pilot.c.surname,
+         weighed.c.date, weighed.c.tow_bar_weight,
+         difference.label('difference'), status.label('status')],
+        from_obj=[glider_card.join(
+            glider_type, glider_card.c.glider_type_id == glider_type.c.id
+        ).join(
+            pilot, glider_card.c.pilot_id == pilot.c.id
+        ).outerjoin(
+            weighed, weighed.c.glider_card_id == glider_card.c.id)]
+    ).order_by(glider_card.c.competition_number)
+
+
+def daily_report(connection, day, allowed_difference=None):
+    """
+    daily_report(Connection connection, date day,
+    int allowed_difference=None) -> list - return DailyReportRow of every
+    glider card counted by one query
+    """
+    return [
+        DailyReportRow(row) for row in connection.execute(
+            daily_report_query(day, allowed_difference))]
@@ -0,0 +1,231 @@
+"""
+Glider cards search and list ordering
+"""
+
+from sqlalchemy import Table, Column, Integer, String, Text, MetaData, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import contains_eager, joinedload, subqueryload
+from sqlalchemy.ext.hybrid import hybrid_property
+
+from igcweight import settings
+
+from igcweight.database import engine
+from igcweight.models import GliderCard, GliderType, Pilot, GliderCardStatus
+
+FIELDS = ('competition_number', 'registration', 'glider_type', 'pilot')
+
+# Search index is not a part of the models metadata, it is maintained by
+# database triggers
+glider_card_fts = Table(
+    'glider_card_fts', MetaData(),
+    Column('rowid', Integer),
+    Column('registration', Text),
+    Column('glider_type', Text),
+    Column('surname', Text)
+)
+
+FTS_CREATE = """
+CREATE VIRTUAL TABLE glider_card_fts USING fts5(
+    registration, glider_type, surname, tokenize='trigram')
+"""
+
+FTS_FILL = """
+INSERT INTO glider_card_fts (rowid, registration, glider_type, surname)
+SELECT glider_card.glider_card_id, glider_card.registration,
+       glider_type.name, pilot.surname
+FROM glider_card
+JOIN glider_type ON glider_type.glider_type_id = glider_card.glider_type_id
+JOIN pilot ON pilot.pilot_id = glider_card.pilot_id
+"""
+
+FTS_TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS glider_card_fts_insert
+    AFTER INSERT ON glider_card BEGIN
+        INSERT INTO glider_card_fts (
+            rowid, registration, glider_type, surname)
+        VALUES (
+            new.glider_card_id, new.registration,
+            (SELECT name FROM glider_type
+             WHERE glider_type_id = new.glider_type_id),
+            (SELECT surname FROM pilot WHERE pilot_id = new.pilot_id));
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS glider_card_fts_update
+    AFTER UPDATE OF glider_card_id, registration, glider_type_id, pilot_id
+    ON glider_card BEGIN
+        DELETE FROM glider_card_fts WHERE rowid = old.glider_card_id;
+        INSERT INTO glider_card_fts (
+            rowid, registration, glider_type, surname)
+        VALUES (
+            new.glider_card_id, new.registration,
+            (SELECT name FROM glider_type
+             WHERE glider_type_id = new.glider_type_id),
+            (SELECT surname FROM pilot WHERE pilot_id = new.pilot_id));
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS glider_card_fts_delete
+    AFTER DELETE ON glider_card BEGIN
+        DELETE FROM glider_card_fts WHERE rowid = old.glider_card_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS glider_card_fts_glider_type
+    AFTER UPDATE OF name ON glider_type BEGIN
+        UPDATE glider_card_fts SET glider_type = new.name
+        WHERE rowid IN (
+            SELECT glider_card_id FROM glider_card
+            WHERE glider_type_id = new.glider_type_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS glider_card_fts_pilot
+    AFTER UPDATE OF surname ON pilot BEGIN
+        UPDATE glider_card_fts SET surname = new.surname
+        WHERE rowid IN (
+            SELECT glider_card_id FROM glider_card
+            WHERE pilot_id = new.pilot_id);
+    END
+    """,
+)
+
+
+def _install_fts():
+    """
+    _install_fts() -> bool - create search index and its triggers if they
+    don't exist, return False if database doesn't support it
+    """
+    if engine.name != 'sqlite':
+        return False
+    connection = engine.connect()
+    try:
+        trans = connection.begin()
+        try:
+            exists = connection.execute(
+                "SELECT name FROM sqlite_master "
+                "WHERE type = 'table' AND name = 'glider_card_fts'"
+            ).fetchall()
+            if not exists:
+                connection.execute(FTS_CREATE)
+                connection.execute(FTS_FILL)
+            for trigger in FTS_TRIGGERS:
+                connection.execute(trigger)
+            trans.commit()
+        except OperationalError:
+            # SQLite is compiled without FTS5 or trigram tokenizer
+            trans.rollback()
+            return False
+    finally:
+        connection.close()
+    return True
+
+FTS_AVAILABLE = _install_fts()
+
+
+def glider_card_query(session, loading=None):
+    """
+    glider_card_query(Session session, str loading=None) -> Query - return
+    base query of glider cards joined with pilots and glider types;
+    loading is 'lazy', 'joined' or 'subquery' strategy of related records,
+    default is settings.GLIDER_CARD_LOADING
+    """
+    if loading is None:
+        loading = settings.GLIDER_CARD_LOADING
+    query = session.query(
+        GliderCard
+    ).join(
+        (Pilot, GliderCard.pilot_id == Pilot.id),
+        (GliderType, GliderCard.glider_type_id == GliderType.id)
+    )
+    if loading == 'joined':
+        query = query.options(
+            contains_eager(GliderCard.pilot),
+            contains_eager(GliderCard.glider_type),
+            joinedload(GliderCard.organization),
+            joinedload(GliderCard.photos),
+            joinedload(GliderCard.daily_weight))
+    elif loading == 'subquery':
+        query = query.options(
+            contains_eager(GliderCard.pilot),
+            contains_eager(GliderCard.glider_type),
+            joinedload(GliderCard.organization),
+            subqueryload(GliderCard.photos),
+            subqueryload(GliderCard.daily_weight))
+    elif loading != 'lazy':
+        raise ValueError("Unknown loading strategy '%s'" % loading)
+    return query
+
+
+def glider_card_filter(field, value):
+    """
+    glider_card_filter(str field, str value) -> clause - return filter of
+    glider card query; registration and glider type are searched by
+    substring, pilot by surname prefix, competition number exactly
+    """
+    if field == 'competition_number':
+        return GliderCard.competition_number.ilike(value)
+    if FTS_AVAILABLE:
+        if field == 'registration':
+            clause = glider_card_fts.c.registration.like('%%%s%%' % value)
+        elif field == 'glider_type':
+            clause = glider_card_fts.c.glider_type.like('%%%s%%' % value)
+        elif field == 'pilot':
+            clause = glider_card_fts.c.surname.like('%s%%' % value)
+        else:
+            raise ValueError("Unknown search field '%s'" % field)
+        return GliderCard.id.in_(select([glider_card_fts.c.rowid], clause))
+    if field == 'registration':
+        return GliderCard.registration.ilike('%%%s%%' % value)
+    elif field == 'glider_type':
+        return GliderType.name.ilike('%%%s%%' % value)
+    elif field == 'pilot':
+        return Pilot.surname.ilike('%s%%' % value)
+    else:
+        raise ValueError("Unknown search field '%s'" % field)
+
+
+def non_compliant_filter():
+    """
+    non_compliant_filter() -> clause - return filter of glider card query,
+    only glider cards with non-compliant weight status are selected
+    """
+    status = GliderCardStatus.__table__
+    return GliderCard.id.in_(
+        select([status.c.id], status.c.compliant == False))
+
+
+def collate(column):
+    """
+    collate(Column column) -> clause - return column compared by locale
+    collation when database supports it
+    """
+    if engine.name == 'sqlite':
+        return column.collate('locale')
+    return column
+
+
+def order_clauses(model, fieldname):
+    """
+    order_clauses(class model, str fieldname) -> list - return ORDER BY
+    clauses of list column, None if database can't sort by it
+    """
+    if model is GliderCard:
+        # Relations are sorted as they are displayed, glider card query
+        # is joined with them
+        if fieldname == 'glider_type':
+            return [collate(GliderType.name)]
+        if fieldname == 'pilot':
+            return [
+                collate(Pilot.surname), collate(Pilot.firstname),
+                collate(Pilot.degree)]
+        # Weight differences and coefficient are hybrid properties
+        if isinstance(GliderCard.__dict__.get(fieldname), hybrid_property):
+            return [getattr(GliderCard, fieldname)]
+    column = model.__table__.c.get(fieldname)
+    if column is None:
+        return None
+    if isinstance(column.type, String):
+        return [collate(column)]
+    return [column]
@@ -44,7 +44,6 @@ IMAGES_DIR = join(BASE_DIR, 'images')
 LOCALE_DIR = join(BASE_DIR, 'locale')
 TEMPLATES_DIR = join(BASE_DIR, 'templates')
 CONFIG_FILE = join(HOME_DIR, 'igcweight.conf')
-XML_DATA = join(HOME_DIR, 'igcweight.xml')
 
 if not isdir(HOME_DIR):
     mkdir(HOME_DIR)
@@ -55,6 +54,14 @@ if not isdir(IMG_CACHE_DIR):
 
 SHOW_PHOTO_APP = None
 
+# Memory budget of photo thumbnails kept in memory, in bytes
+THUMBNAILS_CACHE_SIZE = 32 * 1024 * 1024
+# Size limit of thumbnails directory, in bytes
+IMG_CACHE_SIZE = 256 * 1024 * 1024
+
+# Export photos as one photo pack instead of a file per photo
+EXPORT_PHOTO_PACK = False
+
 DB_ENGINE = 'sqlite'
 DB_HOST = ''
 DB_PORT = ''
@@ -63,4 +70,8 @@ DB_USERNAME = ''
 DB_PASSWORD = ''
 DB_ARGS = {}
 
+# Loading strategy of glider card relations in the main list, 'lazy',
+# 'joined' or 'subquery'
+GLIDER_CARD_LOADING = 'subquery'
+
 configuration = Configuration(CONFIG_FILE)
@@ -41,6 +41,12 @@ setup(
         'sqlalchemy',
         'wx',
     ],
+    extras_require={
+        # Fast thumbnails of large photos
+        'thumbnails': ['Pillow'],
+        # Vectorized fleet handicaps
+        'handicap': ['numpy'],
+    },
     entry_points={
         'console_scripts': [
             'igcweight = igcweight.main:main',